@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Compares memory and construction time of the slotted Accesspoint model
+with an equivalent plain dataclass and a slotted, frozen one.
+
+Usage: python benchmarks/bench_accesspoint.py [aps] [repeats]
+"""
+
+import dataclasses
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fleet import make_accesspoint
+from omada_respondd.omada_client import Accesspoint
+
+FIELDS = [(field.name, field.type) for field in dataclasses.fields(Accesspoint)]
+PlainAccesspoint = dataclasses.make_dataclass("PlainAccesspoint", FIELDS)
+FrozenAccesspoint = dataclasses.make_dataclass(
+    "FrozenAccesspoint", FIELDS, slots=True, frozen=True
+)
+
+
+def build(cls, count):
+    return [make_accesspoint(i, cls) for i in range(count)]
+
+
+def measure_memory(cls, count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fleet = build(cls, count)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del fleet
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    for name, cls in [
+        ("plain dataclass", PlainAccesspoint),
+        ("slotted", Accesspoint),
+        ("slotted, frozen", FrozenAccesspoint),
+    ]:
+        size = measure_memory(cls, count)
+        best = min(timeit.repeat(lambda: build(cls, count), number=1, repeat=repeats))
+        print(
+            "%-16s %7.1f bytes/AP %8.2f ms to build %d APs"
+            % (name, size / count, best * 1000, count)
+        )
+
+
+if __name__ == "__main__":
+    main()
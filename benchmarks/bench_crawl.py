@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Crawls a mock Omada controller with get_infos() and reports crawl time,
+request counts and memory per fleet size.
+
+Each fleet is served by benchmarks/mock_controller.py in a separate process,
+so its CPU time and memory don't distort the numbers of the crawler. Per
+fleet three crawls run with the real Omada client:
+- cold: new session, empty caches, includes login and the nodelist download
+- warm: right after the cold one, shows the effect of caches and --incremental
+- memory: cold again under tracemalloc, reports the peak of traced allocations
+
+Usage: python benchmarks/bench_crawl.py [--sizes 10 100 1000 5000]
+           [--latency SECONDS] [--workers N] [--incremental] [--adaptive-paging]
+           [--expire-after N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_controller import MockFleet
+from omada_respondd import omada_client
+from omada_respondd.config import Config
+
+MOCK_CONTROLLER = os.path.join(os.path.dirname(__file__), "mock_controller.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_controller(args, aps, port):
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            MOCK_CONTROLLER,
+            "--aps=%d" % aps,
+            "--aps-per-site=%d" % args.aps_per_site,
+            "--clients-per-ap=%d" % args.clients_per_ap,
+            "--latency=%f" % args.latency,
+            "--expire-after=%d" % args.expire_after,
+            "--port=%d" % port,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return process, process.stdout.readline().strip()
+
+
+def server_requests(url):
+    with urllib.request.urlopen(url + "/stats") as response:
+        return json.load(response)["requests"]
+
+
+def make_config(args, url, fleet, cache_file):
+    return Config(
+        controller_url=url,
+        controller_port=int(url.rsplit(":", 1)[1]),
+        username="bench",
+        password="bench",
+        ssid_regex=".*freifunk.*",
+        offloader_mac=fleet.offloader_macs(),
+        nodelist=url + "/nodelist.json",
+        multicast_address="ff05::2:1001",
+        multicast_port=1001,
+        unicast_address="::1",
+        unicast_port=10001,
+        interface="lo",
+        fallback_domain="bench",
+        max_workers=args.workers,
+        http_retries=0,
+        incremental=args.incremental,
+        page_size=args.page_size,
+        client_page_size=args.client_page_size,
+        adaptive_paging=args.adaptive_paging,
+        geocode_cache_file=cache_file,
+    )
+
+
+def reset():
+    """Drops the shared session, caches and nodelist so the next crawl is cold."""
+    if omada_client._nodelist is not None:
+        omada_client._nodelist.stop()
+    omada_client._omada = None
+    omada_client._caches = None
+    omada_client._nodelist = None
+
+
+def crawl(cfg, url):
+    before = server_requests(url)
+    start = time.perf_counter()
+    snapshot = omada_client.get_infos(cfg)
+    duration = time.perf_counter() - start
+    after = server_requests(url)
+    requests = {
+        endpoint: count - before.get(endpoint, 0)
+        for endpoint, count in after.items()
+        if count > before.get(endpoint, 0)
+    }
+    return snapshot, duration, requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--aps-per-site", type=int, default=50)
+    parser.add_argument("--clients-per-ap", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--client-page-size", type=int, default=1000)
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--adaptive-paging", action="store_true")
+    parser.add_argument("--expire-after", type=int, default=0)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(
+        "latency %.1fms, %d workers, incremental %s"
+        % (args.latency * 1000, args.workers, args.incremental)
+    )
+    print(
+        "%6s %5s %9s %9s %9s %9s %6s %11s  %s"
+        % (
+            "APs",
+            "sites",
+            "cold s",
+            "warm s",
+            "cold req",
+            "warm req",
+            "pages",
+            "peak MiB",
+            "cold requests per endpoint",
+        )
+    )
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        cache_file = os.path.join(directory, "geocode_cache.json")
+        for size in args.sizes:
+            fleet = MockFleet(size, args.aps_per_site, args.clients_per_ap)
+            process, url = start_controller(args, size, port)
+            try:
+                cfg = make_config(args, url, fleet, cache_file)
+                reset()
+                cold, cold_duration, cold_requests = crawl(cfg, url)
+                _, warm_duration, warm_requests = crawl(cfg, url)
+
+                reset()
+                tracemalloc.start()
+                crawl(cfg, url)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            finally:
+                reset()
+                process.terminate()
+                process.wait()
+
+            if cold is None or len(cold.accesspoints) != size:
+                print("%6d crawl failed or incomplete" % size)
+                continue
+            print(
+                "%6d %5d %9.3f %9.3f %9d %9d %6d %11.1f  %s"
+                % (
+                    size,
+                    len(fleet.sites),
+                    cold_duration,
+                    warm_duration,
+                    sum(cold_requests.values()),
+                    sum(warm_requests.values()),
+                    cold.page_requests,
+                    peak / 2**20,
+                    ", ".join("%s %d" % item for item in sorted(cold_requests.items())),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Compares one sendto per datagram with batched sendmmsg over loopback.
+
+Usage: python benchmarks/bench_sendmmsg.py [datagrams] [repeats] [batch_size]
+"""
+
+import os
+import socket
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from omada_respondd.sendmmsg import BatchSender, Datagrams
+
+
+def drain(sock):
+    received = 0
+    try:
+        while True:
+            sock.recv(2048)
+            received += 1
+    except BlockingIOError:
+        return received
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+
+    receiver = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 23)
+    receiver.bind(("::1", 0))
+    receiver.setblocking(False)
+    address = receiver.getsockname()
+    sender = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+
+    payloads = [os.urandom(600) for _ in range(count)]
+    datagrams = Datagrams(payloads)
+    batch = BatchSender(sender, batch_size=batch_size)
+
+    def send_each():
+        for data in payloads:
+            sender.sendto(data, address)
+
+    def send_batched():
+        batch.sendall(datagrams, address)
+
+    for name, func in [
+        ("sendto loop", send_each),
+        ("sendmmsg, %d per call" % batch.batch_size, send_batched),
+    ]:
+        times = []
+        for _ in range(repeats):
+            times.append(timeit.timeit(func, number=1))
+            assert drain(receiver) == count
+        print("%-24s %8.3f ms for %d datagrams" % (name, min(times) * 1000, count))
+
+
+if __name__ == "__main__":
+    main()
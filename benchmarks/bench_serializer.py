@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Compares dataclasses_json's to_dict() with the direct respondd serializer.
+
+Usage: python benchmarks/bench_serializer.py [nodes] [repeats]
+
+dataclasses_json is no longer a dependency, install it to run the comparison.
+"""
+
+import dataclasses
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dataclasses_json import dataclass_json
+from fleet import make_accesspoints
+from omada_respondd import respondd_client
+
+
+@dataclass_json
+class LegacyNodeInfo(respondd_client.NodeInfo):
+    pass
+
+
+@dataclass_json
+class LegacyStatisticsInfo(respondd_client.StatisticsInfo):
+    pass
+
+
+@dataclass_json
+class LegacyNeighboursInfo(respondd_client.NeighboursInfo):
+    pass
+
+
+LEGACY = {
+    respondd_client.NodeInfo: LegacyNodeInfo,
+    respondd_client.StatisticsInfo: LegacyStatisticsInfo,
+    respondd_client.NeighboursInfo: LegacyNeighboursInfo,
+}
+
+
+def to_legacy(info):
+    legacy = LEGACY[type(info)]
+    return legacy(**{f.name: getattr(info, f.name) for f in dataclasses.fields(info)})
+
+
+def serialize(merged):
+    return [
+        json.dumps({key: info.to_dict() for key, info in infos.items()})
+        for infos in merged
+    ]
+
+
+def serialize_direct(merged):
+    return [
+        respondd_client.dumps({key: info.to_dict() for key, info in infos.items()})
+        for infos in merged
+    ]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    client = respondd_client.ResponddClient.__new__(respondd_client.ResponddClient)
+    client._aps = make_accesspoints(count)
+    struct = {
+        key: client.buildStruct(key) for key in ("nodeinfo", "statistics", "neighbours")
+    }
+    merged = list(client.merge_node(struct).values())
+    legacy_merged = [
+        {key: to_legacy(info) for key, info in infos.items()} for infos in merged
+    ]
+
+    direct = [json.loads(data) for data in serialize_direct(merged)]
+    assert direct == [json.loads(data) for data in serialize(legacy_merged)]
+
+    for name, func, data in [
+        ("dataclasses_json", serialize, legacy_merged),
+        ("direct, json", serialize, merged),
+        (
+            "direct, %s" % ("orjson" if respondd_client.orjson else "json"),
+            serialize_direct,
+            merged,
+        ),
+    ]:
+        best = min(timeit.repeat(lambda: func(data), number=1, repeat=repeats))
+        print("%-18s %8.2f ms for %d nodes" % (name, best * 1000, count))
+
+
+if __name__ == "__main__":
+    main()
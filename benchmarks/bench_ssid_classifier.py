@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Compares per-client re.search classification with SsidClassifier.
+
+Usage: python benchmarks/bench_ssid_classifier.py [clients] [repeats]
+"""
+
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from omada_respondd.omada_client import SsidClassifier
+
+SSID_REGEX = ".*freifunk.*"
+SSIDS = ["muenchen.freifunk.net", "Freifunk Gast", "Office", "IoT", "eduroam"]
+
+
+def make_clients(count, aps=80):
+    rng = random.Random(42)
+    return [
+        {
+            "ssid": rng.choice(SSIDS),
+            "channel": rng.choice([1, 6, 11, 36, 44, 100]),
+            "apMac": "AA-BB-CC-00-00-%02X" % rng.randrange(aps),
+            "trafficUp": rng.randrange(10**6),
+            "trafficDown": rng.randrange(10**7),
+        }
+        for _ in range(count)
+    ]
+
+
+def classify_per_client(clients):
+    """The previous approach: re.search per client, counts and traffic in two passes."""
+    counts = {}
+    traffic = {}
+    for client in clients:
+        if re.search(SSID_REGEX, client.get("ssid", ""), re.IGNORECASE):
+            total, count24, count5 = counts.get(client["apMac"], (0, 0, 0))
+            if client.get("channel", 0) > 14:
+                count5 += 1
+            else:
+                count24 += 1
+            counts[client["apMac"]] = (total + 1, count24, count5)
+    for client in clients:
+        if re.search(SSID_REGEX, client.get("ssid", ""), re.IGNORECASE):
+            tx, rx = traffic.get(client["apMac"], (0, 0))
+            traffic[client["apMac"]] = (
+                tx + client.get("trafficUp", 0),
+                rx + client.get("trafficDown", 0),
+            )
+    return counts, traffic
+
+
+def classify_single_pass(clients):
+    return SsidClassifier(SSID_REGEX).index_clients(clients)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    clients = make_clients(count)
+
+    for name, func in [
+        ("re.search per client", classify_per_client),
+        ("SsidClassifier", classify_single_pass),
+    ]:
+        best = min(timeit.repeat(lambda: func(clients), number=1, repeat=repeats))
+        print("%-22s %8.2f ms for %d clients" % (name, best * 1000, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Synthetic AP fleets shared by the benchmarks."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from omada_respondd.omada_client import Accesspoint, Accesspoints
+
+
+def make_accesspoint(i, cls=Accesspoint):
+    """Returns a realistic AP with a unique MAC address built from `i`."""
+    mac = "aa:bb:cc:%02x:%02x:%02x" % (i >> 16, (i >> 8) & 0xFF, i & 0xFF)
+    return cls(
+        name="ap%d" % i,
+        mac=mac,
+        node_id=mac.replace(":", ""),
+        snmp_location="48.1351, 11.5820",
+        client_count=12,
+        client_count24=4,
+        client_count5=8,
+        latitude=48.1351,
+        longitude=11.582,
+        model="EAP245(EU) v3.0",
+        firmware="5.0.7",
+        uptime=123456,
+        contact="noc@example.org",
+        load_avg=0.12,
+        mem_used=60000,
+        mem_total=120000,
+        mem_buffer=1000,
+        tx_bytes=123456789,
+        rx_bytes=987654321,
+        gateway="00:11:22:33:44:55",
+        gateway6="00:11:22:33:44:55",
+        gateway_nexthop="001122334455",
+        neighbour_macs=("00:11:22:33:44:55", "aa:bb:cc:dd:ee:ff"),
+        domain_code="ffmuc_muc_cty",
+        frequency24=2412,
+        frequency5=5180,
+    )
+
+
+def make_accesspoints(count):
+    """Returns a snapshot of `count` APs."""
+    return Accesspoints(accesspoints=tuple(make_accesspoint(i) for i in range(count)))
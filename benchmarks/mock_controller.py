@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""A stand-in Omada controller serving a synthetic fleet over HTTP.
+
+It implements the endpoints omada.Omada uses during a crawl (/api/info,
+/login, /users/current, /sites/{key}/devices, /sites/{key}/eaps/{mac},
+the paged /sites/{key}/clients and /sites/{key}/setting) plus a nodelist
+on /nodelist.json that knows the offloader of every site. The requests
+served so far are counted per endpoint on /stats. With --expire-after N
+the session token expires after every N authenticated requests, so the
+client has to log in again in the middle of a crawl.
+
+Usage: python benchmarks/mock_controller.py [--aps N] [--aps-per-site N]
+           [--clients-per-ap N] [--latency SECONDS] [--expire-after N]
+           [--address A] [--port P]
+"""
+
+import argparse
+import collections
+import json
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OMADAC_ID = "0123456789abcdef0123456789abcdef"
+SSIDS = ("muenchen.freifunk.net", "private")
+
+ROUTES = [
+    ("devices", re.compile(r"^/sites/(?P<key>[0-9a-f]{24})/devices$")),
+    ("eap", re.compile(r"^/sites/(?P<key>[0-9a-f]{24})/eaps/(?P<mac>[0-9A-F-]{17})$")),
+    ("clients", re.compile(r"^/sites/(?P<key>[0-9a-f]{24})/clients$")),
+    ("settings", re.compile(r"^/sites/(?P<key>[0-9a-f]{24})/setting$")),
+    ("user", re.compile(r"^/users/current$")),
+]
+
+
+class MockFleet:
+    """This class generates the controller view of `aps` APs spread over sites.
+
+    Everything is derived from the AP number, so two fleets of the same size
+    answer identically and nothing but the site list is kept in memory."""
+
+    def __init__(self, aps: int, aps_per_site: int = 50, clients_per_ap: int = 10):
+        self.aps = aps
+        self.aps_per_site = aps_per_site
+        self.clients_per_ap = clients_per_ap
+        count = max(1, -(-aps // aps_per_site))
+        self.sites = [
+            {"name": "Site%d" % i, "key": "%024x" % (i + 1)} for i in range(count)
+        ]
+        self._index = {site["key"]: i for i, site in enumerate(self.sites)}
+
+    @staticmethod
+    def mac(i: int) -> str:
+        return "AA-BB-%02X-%02X-%02X-%02X" % (
+            (i >> 24) & 0xFF,
+            (i >> 16) & 0xFF,
+            (i >> 8) & 0xFF,
+            i & 0xFF,
+        )
+
+    @staticmethod
+    def offloader_mac(site: int) -> str:
+        return "02:00:00:00:%02x:%02x" % ((site >> 8) & 0xFF, site & 0xFF)
+
+    def site_index(self, key: str) -> int:
+        return self._index[key]
+
+    def ap_numbers(self, site: int) -> range:
+        return range(
+            site * self.aps_per_site, min(self.aps, (site + 1) * self.aps_per_site)
+        )
+
+    def offloader_macs(self) -> dict:
+        return {
+            site["name"]: self.offloader_mac(i) for i, site in enumerate(self.sites)
+        }
+
+    def nodelist(self) -> dict:
+        return {
+            "nodes": [
+                {
+                    "mac": self.offloader_mac(i),
+                    "gateway": "02:00:00:00:ff:%02x" % (i & 0xFF),
+                    "gateway6": "02:00:00:00:ff:%02x" % (i & 0xFF),
+                    "domain": "ffmuc_muc_cty",
+                }
+                for i in range(len(self.sites))
+            ]
+        }
+
+    def device(self, i: int) -> dict:
+        return {
+            "type": "ap",
+            "mac": self.mac(i),
+            "name": "ap%d" % i,
+            "model": "EAP245(EU)",
+            "showModel": "EAP245(EU) v3.0",
+            "version": "5.0.7",
+            "status": 14,
+            "uptimeLong": 100000 + i,
+            "cpuUtil": 5,
+            "memUtil": 40,
+            "download": 1000 * i,
+            "upload": 500 * i,
+            "clientNum": self.clients_per_ap,
+        }
+
+    def details(self, i: int) -> dict:
+        return {
+            "mac": self.mac(i),
+            "name": "ap%d" % i,
+            "ssidOverrides": [
+                {"ssid": ssid, "ssidEnabled": True, "enable": True} for ssid in SSIDS
+            ],
+            "radioTraffic2g": {"tx": 1000 * i, "rx": 2000 * i},
+            "radioTraffic5g": {"tx": 3000 * i, "rx": 4000 * i},
+            "wp2g": {"actualChannel": "1 / 2412MHz"},
+            "wp5g": {"actualChannel": "36 / 5180MHz"},
+            "uptimeLong": 100000 + i,
+            "cpuUtil": 5,
+            "memUtil": 40,
+            "location": {"latitude": 48.1351, "longitude": 11.582},
+            "snmp": {"location": "48.1351, 11.5820", "contact": "noc@example.org"},
+        }
+
+    def clients(self, site: int) -> list:
+        return [
+            {
+                "mac": "CC-%02X-%02X-%02X-%02X-%02X"
+                % ((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF, c >> 8, c & 0xFF),
+                "apMac": self.mac(i),
+                "ssid": SSIDS[c % len(SSIDS)],
+                "channel": 36 if c % 2 else 6,
+                "trafficUp": 100 * c,
+                "trafficDown": 200 * c,
+            }
+            for i in self.ap_numbers(site)
+            for c in range(self.clients_per_ap)
+        ]
+
+
+class MockController(threading.Thread):
+    """This class serves a MockFleet, every request is delayed by `latency` seconds.
+
+    If `expire_after` is set, the session expires after that many
+    authenticated requests and every login issues a new token."""
+
+    def __init__(
+        self,
+        fleet: MockFleet,
+        latency: float = 0.0,
+        address: str = "127.0.0.1",
+        port: int = 0,
+        expire_after: int = 0,
+    ):
+        super().__init__(name="mock-controller", daemon=True)
+        self.fleet = fleet
+        self.latency = latency
+        self.expire_after = expire_after
+        self.requests = collections.Counter()
+        self._lock = threading.Lock()
+        self._sessions = 0
+        self._token = None
+        self._served = 0
+        controller = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so the connection pool of the client is exercised.
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, without this every
+            # response on a kept-alive connection waits for a delayed ACK.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                controller._handle(self, "GET")
+
+            def do_POST(self):
+                controller._handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        self._server = Server((address, port), Handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def run(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def _login(self) -> str:
+        with self._lock:
+            self._sessions += 1
+            self._token = "mock-token-%d" % self._sessions
+            self._served = 0
+            return self._token
+
+    def _authenticate(self, token: str) -> bool:
+        """Returns whether the token belongs to the current session, expiring it if due."""
+        with self._lock:
+            if token is None or token != self._token:
+                return False
+            self._served += 1
+            if self.expire_after and self._served >= self.expire_after:
+                self._token = None
+                self.requests["expired"] += 1
+            return True
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        url = urllib.parse.urlsplit(handler.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        length = int(handler.headers.get("Content-Length", 0))
+        if length:
+            handler.rfile.read(length)
+
+        if url.path == "/stats":
+            return self._reply(handler, {"requests": dict(self.requests)})
+        if url.path == "/nodelist.json":
+            self._count("nodelist")
+            return self._reply(handler, self.fleet.nodelist())
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if url.path == "/api/info":
+            self._count("info")
+            return self._result(handler, {"omadacId": OMADAC_ID, "apiVer": "3"})
+
+        prefix = "/%s/api/v2" % OMADAC_ID
+        if not url.path.startswith(prefix):
+            return self._reply(handler, None, status=404)
+        path = url.path[len(prefix) :]
+        if method == "POST" and path == "/login":
+            self._count("login")
+            return self._result(handler, {"token": self._login(), "roleType": 1})
+        if method != "GET":
+            return self._reply(handler, None, status=405)
+        if not self._authenticate(handler.headers.get("Csrf-Token")):
+            return self._reply(handler, {"errorCode": -1200, "msg": "Login required"})
+
+        for endpoint, pattern in ROUTES:
+            match = pattern.match(path)
+            if match is not None:
+                break
+        else:
+            return self._reply(handler, None, status=404)
+        self._count(endpoint)
+        fleet = self.fleet
+        if endpoint == "user":
+            return self._result(handler, {"privilege": {"sites": fleet.sites}})
+        try:
+            site = fleet.site_index(match["key"])
+        except KeyError:
+            return self._reply(handler, {"errorCode": -1001, "msg": "Invalid site"})
+        if endpoint == "devices":
+            return self._result(
+                handler, [fleet.device(i) for i in fleet.ap_numbers(site)]
+            )
+        if endpoint == "eap":
+            numbers = {fleet.mac(i): i for i in fleet.ap_numbers(site)}
+            if match["mac"] not in numbers:
+                return self._reply(handler, {"errorCode": -39002, "msg": "No device"})
+            return self._result(handler, fleet.details(numbers[match["mac"]]))
+        if endpoint == "clients":
+            return self._result(handler, self._page(fleet.clients(site), query))
+        return self._result(handler, {"autoUpgrade": {"enable": True}})
+
+    @staticmethod
+    def _page(rows: list, query: dict) -> dict:
+        page = int(query.get("currentPage", 1))
+        size = int(query.get("currentPageSize", 10))
+        return {
+            "totalRows": len(rows),
+            "currentPage": page,
+            "currentSize": size,
+            "data": rows[(page - 1) * size : page * size],
+        }
+
+    def _result(self, handler, result):
+        self._reply(handler, {"errorCode": 0, "msg": "Success.", "result": result})
+
+    @staticmethod
+    def _reply(handler, body, status=200):
+        data = json.dumps(body).encode("UTF-8") if body is not None else b""
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--aps", type=int, default=100)
+    parser.add_argument("--aps-per-site", type=int, default=50)
+    parser.add_argument("--clients-per-ap", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--expire-after", type=int, default=0)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    fleet = MockFleet(args.aps, args.aps_per_site, args.clients_per_ap)
+    controller = MockController(
+        fleet, args.latency, args.address, args.port, args.expire_after
+    )
+    # The benchmark reads the URL from the first line.
+    print(controller.url, flush=True)
+    print(
+        "Serving %d APs in %d sites" % (fleet.aps, len(fleet.sites)),
+        file=sys.stderr,
+        flush=True,
+    )
+    try:
+        controller.run()
+    except KeyboardInterrupt:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
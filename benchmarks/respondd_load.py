@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Fires respondd requests at a running ResponddClient and reports latency,
+throughput and how completely every node answered.
+
+Every requester sends one request per round from a fresh socket, cycling
+through the request patterns, so late datagrams of a previous round can't
+be mistaken for answers. A round ends once --nodes nodes answered or no
+datagram arrived for --timeout seconds. Multi requests ("GET ...") are
+answered with raw deflate compressed JSON, single-key requests with plain
+JSON; a node counts as complete in a round if it answered with every
+requested key.
+
+With --serve blocking|asyncio a mock controller (benchmarks/mock_controller.py)
+and respondd.py are started on the loopback interface first, which allows
+comparing the serving modes without any hardware.
+
+Usage: python benchmarks/respondd_load.py [--target ADDR] [--port PORT]
+           [--interface IF] [--requesters N] [--rounds N] [--request REQ ...]
+           [--serve MODE] [--aps N]
+"""
+
+import argparse
+import collections
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_controller import MockFleet
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+MOCK_CONTROLLER = os.path.join(os.path.dirname(__file__), "mock_controller.py")
+DEFAULT_REQUESTS = ["GET nodeinfo statistics neighbours", "nodeinfo", "statistics"]
+
+
+class Round:
+    """This class contains the outcome of one request.
+    Attributes:
+        request: The request that was sent.
+        first: Seconds until the first datagram arrived, None without answer.
+        last: Seconds until the last datagram arrived, None without answer.
+        datagrams: The number of datagrams received.
+        complete: The ids of the nodes that answered with every requested key.
+        malformed: Datagrams that could not be decompressed or decoded."""
+
+    def __init__(self, request: str):
+        self.request = request
+        self.first = None
+        self.last = None
+        self.datagrams = 0
+        self.complete = set()
+        self.malformed = 0
+
+
+def parse_response(data: bytes, keys: list, multi: bool):
+    """Returns the node id and whether the response contains every requested key."""
+    if multi:
+        node = json.loads(zlib.decompress(data, -15))
+        sections = [node[key] for key in keys if key in node]
+        node_id = next((section.get("node_id") for section in sections), None)
+        return node_id, len(sections) == len(keys)
+    node = json.loads(data)
+    return node.get("node_id"), True
+
+
+def run_round(args, address, request: str) -> Round:
+    result = Round(request)
+    parts = request.split(" ")
+    multi = parts[0] == "GET"
+    keys = parts[1:] if multi else parts[:1]
+    with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        if args.interface:
+            index = socket.if_nametoindex(args.interface)
+            sock.setsockopt(
+                socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, struct.pack("I", index)
+            )
+        sock.settimeout(args.timeout)
+        start = time.perf_counter()
+        sock.sendto(request.encode("UTF-8"), address)
+        while args.nodes is None or len(result.complete) < args.nodes:
+            try:
+                data = sock.recv(65535)
+            except socket.timeout:
+                break
+            elapsed = time.perf_counter() - start
+            if result.first is None:
+                result.first = elapsed
+            result.last = elapsed
+            result.datagrams += 1
+            try:
+                node_id, complete = parse_response(data, keys, multi)
+            except (zlib.error, ValueError, AttributeError):
+                result.malformed += 1
+                continue
+            if complete and node_id is not None:
+                result.complete.add(node_id)
+    return result
+
+
+def requester(args, address, offset, rounds):
+    for i in range(args.rounds):
+        rounds.append(
+            run_round(args, address, args.request[(offset + i) % len(args.request)])
+        )
+        if args.interval > 0:
+            time.sleep(args.interval)
+
+
+def quantile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(args, rounds, duration):
+    datagrams = sum(result.datagrams for result in rounds)
+    print(
+        "%d rounds in %.2fs, %.0f rounds/s, %d datagrams, %.0f responses/s, %d malformed"
+        % (
+            len(rounds),
+            duration,
+            len(rounds) / duration,
+            datagrams,
+            datagrams / duration,
+            sum(result.malformed for result in rounds),
+        )
+    )
+    print(
+        "%-36s %6s %9s %9s %9s %9s %8s %8s"
+        % (
+            "request",
+            "rounds",
+            "first p50",
+            "first p99",
+            "last p50",
+            "last p99",
+            "nodes",
+            "complete",
+        )
+    )
+    by_request = collections.defaultdict(list)
+    for result in rounds:
+        by_request[result.request].append(result)
+    for request, results in by_request.items():
+        # Without --nodes every node that ever answered is expected in every round.
+        answered = collections.Counter(
+            node_id for result in results for node_id in result.complete
+        )
+        expected = args.nodes if args.nodes is not None else len(answered)
+        # Expected nodes that never answered count with 0%.
+        missing = max(0, expected - len(answered))
+        completeness = [count / len(results) for count in answered.values()]
+        completeness += [0.0] * missing
+        first = [result.first for result in results if result.first is not None]
+        last = [result.last for result in results if result.last is not None]
+        print(
+            "%-36s %6d %8.1fms %8.1fms %8.1fms %8.1fms %8d %7.1f%%"
+            % (
+                request,
+                len(results),
+                quantile(first, 0.5) * 1000,
+                quantile(first, 0.99) * 1000,
+                quantile(last, 0.5) * 1000,
+                quantile(last, 0.99) * 1000,
+                expected,
+                100 * sum(completeness) / max(1, len(completeness)),
+            )
+        )
+        incomplete = sorted(
+            (count, node_id)
+            for node_id, count in answered.items()
+            if count < len(results)
+        )
+        for count, node_id in incomplete[:5]:
+            print("    %s answered %d of %d rounds" % (node_id, count, len(results)))
+
+
+def free_port(kind):
+    with socket.socket(socket.AF_INET6, kind) as sock:
+        sock.bind(("::1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(args, directory):
+    """Starts a mock controller and respondd.py on loopback, returns both processes."""
+    fleet = MockFleet(args.aps)
+    controller = subprocess.Popen(
+        [
+            sys.executable,
+            MOCK_CONTROLLER,
+            "--aps=%d" % args.aps,
+            "--port=%d" % free_port(socket.SOCK_STREAM),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    url = controller.stdout.readline().strip()
+    path = os.path.join(directory, "OMADA_respondd.yaml")
+    with open(path, "w") as stream:
+        yaml.safe_dump(
+            {
+                "controller_url": url,
+                "controller_port": int(url.rsplit(":", 1)[1]),
+                "username": "bench",
+                "password": "bench",
+                "ssid_regex": ".*freifunk.*",
+                "offloader_mac": fleet.offloader_macs(),
+                "nodelist": url + "/nodelist.json",
+                "ssl_verify": False,
+                "multicast_enabled": True,
+                "multicast_address": "ff02::2:1001",
+                "multicast_port": args.port,
+                "unicast_address": "::1",
+                "unicast_port": args.port,
+                "interface": "lo",
+                "verbose": False,
+                "server_mode": args.serve,
+                "trace_buffer_size": 0,
+                "geocode_cache_file": os.path.join(directory, "geocode_cache.json"),
+                "logging_config": {
+                    "version": 1,
+                    "handlers": {"console": {"class": "logging.StreamHandler"}},
+                    "root": {"handlers": ["console"], "level": "WARNING"},
+                },
+            },
+            stream,
+        )
+    respondd = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "respondd.py")],
+        env=dict(os.environ, OMADA_RESPONDD_CONFIG_FILE=path),
+        cwd=directory,
+    )
+    return controller, respondd
+
+
+def wait_until_ready(args, address, deadline=60):
+    """Waits for the first answer, the first request triggers the initial crawl."""
+    started = time.monotonic()
+    while time.monotonic() - started < deadline:
+        if run_round(args, address, args.request[0]).datagrams > 0:
+            return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", default="::1")
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--interface", default=None)
+    parser.add_argument("--requesters", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=0.5)
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--request", action="append", default=None)
+    parser.add_argument("--serve", choices=["blocking", "asyncio"], default=None)
+    parser.add_argument("--aps", type=int, default=500)
+    args = parser.parse_args()
+    args.request = args.request or DEFAULT_REQUESTS
+
+    processes = []
+    with tempfile.TemporaryDirectory() as directory:
+        if args.serve is not None:
+            args.target = "::1"
+            args.port = args.port or free_port(socket.SOCK_DGRAM)
+            args.nodes = args.nodes or args.aps
+            processes = serve(args, directory)
+        elif args.port is None:
+            args.port = 1001
+        target = args.target
+        if (
+            args.interface
+            and "%" not in target
+            and target.lower().startswith(("fe80:", "ff02:"))
+        ):
+            target = "%s%%%s" % (target, args.interface)
+        address = socket.getaddrinfo(
+            target, args.port, socket.AF_INET6, socket.SOCK_DGRAM
+        )[0][4]
+
+        try:
+            if not wait_until_ready(args, address):
+                print("No answer from %s port %d" % (args.target, args.port))
+                return
+            rounds = []
+            threads = [
+                threading.Thread(target=requester, args=(args, address, i, rounds))
+                for i in range(args.requesters)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            report(args, rounds, time.perf_counter() - start)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
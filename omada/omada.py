@@ -29,9 +29,13 @@ import urllib3
 import warnings
 import http.client
 import logging
+import random
+import threading
+import time
 from configparser import ConfigParser
 from datetime import datetime
 from enum import Enum
+from requests.adapters import HTTPAdapter
 from requests.cookies import RequestsCookieJar
 
 # define Logger for class-wide usage
@@ -72,6 +76,25 @@ class OmadaError(Exception):
         return f"errorCode={self.errorCode}, msg={self.msg}"
 
 
+##
+## Spaces out requests so that at most `rate` requests per second are started.
+##
+class RateLimiter:
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.nextSlot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.nextSlot, now)
+            self.nextSlot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
 ##
 ## The main Omada API class.
 ##
@@ -82,6 +105,21 @@ class Omada:
     ##
     ApiPath = "/api/v2"
 
+    ##
+    ## Error codes returned by the API when the login session is no longer valid.
+    ##
+    SessionExpiredCodes = (-1200,)
+
+    ##
+    ## Requests with these methods are safe to send again after a failure.
+    ##
+    IdempotentMethods = ("GET", "HEAD")
+
+    ##
+    ## HTTP status codes of a controller or proxy that is temporarily unavailable.
+    ##
+    RetryStatusCodes = (502, 503, 504)
+
     ##
     ## Group types
     ##
@@ -118,14 +156,38 @@ class Omada:
         verify=True,
         warnings=True,
         verbose=False,
+        rateLimit=None,
+        pageSize=10,
+        adaptivePaging=False,
+        maxPageSize=1000,
+        timeout=(5, 30),
+        poolSize=10,
+        retries=2,
+        backoff=0.5,
     ):
 
         self.config = None
         self.loginResult = None
-        self.currentPageSize = 10
+        self.currentPageSize = pageSize
+        self.adaptivePaging = adaptivePaging
+        self.maxPageSize = maxPageSize
+        self.pageRequests = 0
+        self.__pageRequestsLock = threading.Lock()
+        self.__threadPageRequests = threading.local()
         self.currentUser = {}
         self.apiPath = Omada.ApiPath
         self.omadacId = ""
+        self.__username = None
+        self.__password = None
+        self.__loginLock = threading.RLock()
+        self.__relogging = False
+        self.rateLimiter = RateLimiter(rateLimit) if rateLimit else None
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # Called as requestObserver(method, path, params, started, duration, status)
+        # after every request attempt, started is a time.perf_counter() timestamp.
+        self.requestObserver = None
 
         if baseurl is not None:
             # use the provided configuration
@@ -155,6 +217,15 @@ class Omada:
         self.session.cookies = RequestsCookieJar()
         self.session.verify = self.verify
 
+        # Keep up to poolSize connections alive so that concurrent requests don't
+        # open a new connection each. Retries are handled in __send.
+        adapter = HTTPAdapter(
+            pool_connections=poolSize, pool_maxsize=poolSize, max_retries=0
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Connection": "keep-alive"})
+
         # hide warnings about insecure SSL requests
         if self.verify == False and self.warnings == False:
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -193,35 +264,74 @@ class Omada:
         raise PermissionError(f'current user does not have privilege to site "{name}"')
 
     ##
-    ## Perform a GET request and return the result.
+    ## Send a request and return the decoded JSON, or None if the session has expired.
     ##
-    def __get(self, path, params={}, data=None, json=None):
+    def __send(self, method, path, params, **kwargs):
 
-        if self.loginResult is None:
-            raise ConnectionError("not logged in")
+        # The token is filled in here so that a retry after re-login uses the new one.
+        if "token" in params:
+            params["token"] = self.loginResult["token"]
 
-        if not isinstance(params, dict):
-            raise TypeError("params must be a dictionary")
+        # Only idempotent requests are sent again after a timeout or a temporary failure.
+        attempts = self.retries + 1 if method in Omada.IdempotentMethods else 1
+        for attempt in range(attempts):
+            if self.rateLimiter is not None:
+                self.rateLimiter.wait()
 
-        response = self.session.get(
-            self.__buildUrl(path),
-            params=params,
-            data=data,
-            json=json,
-            headers=self.session.headers,
-        )
+            started = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method,
+                    self.__buildUrl(path),
+                    params=params,
+                    timeout=self.timeout,
+                    **kwargs,
+                )
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                self.__observe(method, path, params, started, None)
+                if attempt == attempts - 1:
+                    raise
+                logger.warning(f"{method} {path} failed, retrying: {ex}")
+            else:
+                self.__observe(method, path, params, started, response.status_code)
+                if (
+                    response.status_code not in Omada.RetryStatusCodes
+                    or attempt == attempts - 1
+                ):
+                    break
+                logger.warning(
+                    f"{method} {path} returned {response.status_code}, retrying"
+                )
+            self.__sleepBackoff(attempt)
+
+        if response.status_code == 401:
+            return None
         response.raise_for_status()
 
         json = response.json()
-        if json["errorCode"] == 0:
-            return json["result"] if "result" in json else None
+        if json.get("errorCode") in Omada.SessionExpiredCodes:
+            return None
 
-        raise OmadaError(json)
+        return json
 
     ##
-    ## Perform a POST request and return the result.
+    ## Report a request attempt to the request observer, if there is one.
     ##
-    def __post(self, path, params={}, data=None, files=None, json=None):
+    def __observe(self, method, path, params, started, status):
+        if self.requestObserver is not None:
+            duration = time.perf_counter() - started
+            self.requestObserver(method, path, params, started, duration, status)
+
+    ##
+    ## Wait before the next attempt, with full jitter so that concurrent retries spread out.
+    ##
+    def __sleepBackoff(self, attempt):
+        time.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    ##
+    ## Perform a request and return the decoded JSON. Logs in again once if the session has expired.
+    ##
+    def __request(self, method, path, params, **kwargs):
 
         if self.loginResult is None:
             raise ConnectionError("not logged in")
@@ -229,43 +339,62 @@ class Omada:
         if not isinstance(params, dict):
             raise TypeError("params must be a dictionary")
 
-        params["_"] = timestamp()
-        params["token"] = self.loginResult["token"]
-        response = self.session.post(
-            self.__buildUrl(path), params=params, data=data, files=files, json=json
-        )
-        response.raise_for_status()
+        token = self.loginResult["token"]
+        json = self.__send(method, path, params, **kwargs)
+        if json is None:
+            self.__relogin(token)
+            json = self.__send(method, path, params, **kwargs)
+            if json is None:
+                raise ConnectionError("session expired right after login")
 
-        json = response.json()
         if json["errorCode"] == 0:
-            return json["result"] if "result" in json else None
+            return json
 
         raise OmadaError(json)
 
     ##
-    ## Perform a PATCH request and return the result.
+    ## Replace an expired session with a new one, unless another thread already did.
     ##
-    def __patch(self, path, params={}, data=None, json=None):
+    def __relogin(self, token):
+        with self.__loginLock:
+            if self.loginResult is not None and self.loginResult["token"] != token:
+                return
+            if self.__username is None or self.__relogging:
+                raise ConnectionError("session expired and cannot be renewed")
+            self.__relogging = True
+            try:
+                # The expired session stays in place until the new one is
+                # established, so other threads never see no session at all.
+                self.__login(self.__username, self.__password)
+            finally:
+                self.__relogging = False
 
-        if self.loginResult is None:
-            raise ConnectionError("not logged in")
+    ##
+    ## Perform a GET request and return the result.
+    ##
+    def __get(self, path, params={}, data=None, json=None):
+        json = self.__request("GET", path, params, data=data, json=json)
+        return json["result"] if "result" in json else None
 
-        if not isinstance(params, dict):
-            raise TypeError("params must be a dictionary")
+    ##
+    ## Perform a POST request and return the result.
+    ##
+    def __post(self, path, params={}, data=None, files=None, json=None):
 
         params["_"] = timestamp()
-        params["token"] = self.loginResult["token"]
-
-        response = self.session.patch(
-            self.__buildUrl(path), params=params, data=data, json=json
-        )
-        response.raise_for_status()
+        params["token"] = None
+        json = self.__request("POST", path, params, data=data, files=files, json=json)
+        return json["result"] if "result" in json else None
 
-        json = response.json()
-        if json["errorCode"] == 0:
-            return json["result"] if "result" in json else None
+    ##
+    ## Perform a PATCH request and return the result.
+    ##
+    def __patch(self, path, params={}, data=None, json=None):
 
-        raise OmadaError(json)
+        params["_"] = timestamp()
+        params["token"] = None
+        json = self.__request("PATCH", path, params, data=data, json=json)
+        return json["result"] if "result" in json else None
 
     ##
     ## Return True if a result contains data.
@@ -278,14 +407,8 @@ class Omada:
     ##
     def __getPaged(self, path, params={}, data=None, json=None):
 
-        if self.loginResult is None:
-            raise ConnectionError("not logged in")
-
-        if not isinstance(params, dict):
-            raise TypeError("params must be a dictionary")
-
         params["_"] = timestamp()
-        params["token"] = self.loginResult["token"]
+        params["token"] = None
 
         if "currentPage" not in params:
             params["currentPage"] = 1
@@ -293,18 +416,20 @@ class Omada:
         if "currentPageSize" not in params:
             params["currentPageSize"] = self.currentPageSize
 
-        response = self.session.get(
-            self.__buildUrl(path), params=params, data=data, json=json
-        )
-        response.raise_for_status()
+        with self.__pageRequestsLock:
+            self.pageRequests += 1
+        self.__threadPageRequests.count = self.getThreadPageRequests() + 1
 
-        json = response.json()
-        if json["errorCode"] == 0:
-            json["result"]["path"] = path
-            json["result"]["params"] = params
-            return json["result"]
+        json = self.__request("GET", path, params, data=data, json=json)
+        json["result"]["path"] = path
+        json["result"]["params"] = params
+        return json["result"]
 
-        raise OmadaError(json)
+    ##
+    ## Return the number of paged requests sent by the calling thread so far.
+    ##
+    def getThreadPageRequests(self):
+        return getattr(self.__threadPageRequests, "count", 0)
 
     ##
     ## Returns the next page of data if more is available.
@@ -334,11 +459,29 @@ class Omada:
         params["currentPage"] = currentPage + 1
         return self.__getPaged(path, params)
 
+    ##
+    ## Use the total row count of the first page to fetch everything again in as few pages as possible.
+    ##
+    def __resizePages(self, result, data=None, json=None):
+
+        params = result["params"]
+        totalRows = int(result["totalRows"])
+        pageSize = min(totalRows, self.maxPageSize)
+
+        if len(result["data"]) >= totalRows or pageSize <= params["currentPageSize"]:
+            return result
+
+        params["currentPage"] = 1
+        params["currentPageSize"] = pageSize
+        return self.__getPaged(result["path"], params, data, json)
+
     ##
     ## Perform a GET request and yield the results.
     ##
     def __geterator(self, path, params={}, data=None, json=None):
         result = self.__getPaged(path, params, data, json)
+        if self.adaptivePaging:
+            result = self.__resizePages(result, data, json)
         while self.__hasData(result):
             for item in result["data"]:
                 yield item
@@ -357,7 +500,7 @@ class Omada:
     def getApiInfo(self):
 
         # This uses a different path, so perform request manually.
-        response = self.session.get(self.baseurl + "/api/info")
+        response = self.session.get(self.baseurl + "/api/info", timeout=self.timeout)
         response.raise_for_status()
 
         json = response.json()
@@ -374,13 +517,6 @@ class Omada:
         # Only try to log in if we're not already logged in.
         if self.loginResult is None:
 
-            # Fetch the API info from the controller. (Does not require login.)
-            apiInfo = self.getApiInfo()
-
-            # Store the omadacId value. (Required by version 5.)
-            if "omadacId" in apiInfo:
-                self.omadacId = "/" + apiInfo["omadacId"]
-
             # Get the username and password if not specified.
             if username is None and password is None:
                 if self.config is None:
@@ -391,28 +527,45 @@ class Omada:
                 except:
                     raise
 
-            # Perform the login request manually.
-            response = self.session.post(
-                self.__buildUrl("/login"),
-                json={"username": username, "password": password},
-            )
-            response.raise_for_status()
+            self.__login(username, password)
+
+        return self.loginResult
+
+    ##
+    ## Establish a new session and swap it in once the login succeeded.
+    ##
+    def __login(self, username, password):
 
-            # Get the login response.
-            json = response.json()
-            if json["errorCode"] != 0:
-                raise OmadaError(json)
+        # Fetch the API info from the controller. (Does not require login.)
+        apiInfo = self.getApiInfo()
 
-            # Store the login result.
-            self.loginResult = json["result"]
+        # Store the omadacId value. (Required by version 5.)
+        if "omadacId" in apiInfo:
+            self.omadacId = "/" + apiInfo["omadacId"]
 
-            # Store CSRF token header.
-            self.session.headers.update({"Csrf-Token": self.loginResult["token"]})
+        # Perform the login request manually.
+        response = self.session.post(
+            self.__buildUrl("/login"),
+            json={"username": username, "password": password},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
 
-            # Get the current user info.
-            self.currentUser = self.getCurrentUser()
+        # Get the login response.
+        json = response.json()
+        if json["errorCode"] != 0:
+            raise OmadaError(json)
 
-        return self.loginResult
+        # Store CSRF token header.
+        self.session.headers.update({"Csrf-Token": json["result"]["token"]})
+
+        # Store the login result and the credentials for a later re-login.
+        self.loginResult = json["result"]
+        self.__username = username
+        self.__password = password
+
+        # Get the current user info.
+        self.currentUser = self.getCurrentUser()
 
     ##
     ## Log out of the current session. Return value is always None.
@@ -492,10 +645,14 @@ class Omada:
     ##
     ## Returns the list of active clients for given site.
     ##
-    def getSiteClients(self, site=None):
-        return self.__geterator(
-            f"/sites/{self.__findKey(site)}/clients", params={"filters.active": "true"}
-        )
+    def getSiteClients(self, site=None, pageSize=None):
+
+        params = {"filters.active": "true"}
+
+        if pageSize is not None:
+            params["currentPageSize"] = pageSize
+
+        return self.__geterator(f"/sites/{self.__findKey(site)}/clients", params=params)
 
     ##
     ## Returns the list of active clients for given site and AP.
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import dataclasses
+import itertools
+import threading
+import time
+
+from omada_respondd import config
+from omada_respondd import omada_client
+from omada_respondd import logger
+from omada_respondd import tracing
+from typing import Optional
+
+
+class Collector(threading.Thread):
+    """This class refreshes the Accesspoints snapshot in the background.
+
+    Request handling only ever reads the latest snapshot, so a slow crawl of
+    the Omada controller never blocks a respondd response. With an interval
+    of 0 there is no background crawl and snapshots are only refreshed on
+    demand through get_snapshot().
+
+    Only one crawl runs at a time, callers asking for a refresh while a crawl
+    is in flight wait for that crawl instead of starting another one.
+
+    The traces of the last `trace_size` crawls are kept in `traces`, 0 turns
+    tracing off."""
+
+    def __init__(self, interval: int, trace_size: int = 0):
+        super().__init__(name="omada-collector", daemon=True)
+        self._interval = interval
+        self._trace_size = trace_size
+        self.traces = tracing.TraceBuffer(trace_size)
+        self._snapshot: Optional[omada_client.Accesspoints] = None
+        self._generations = itertools.count(1)
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._flight_lock = threading.Lock()
+        self._flight: Optional[threading.Event] = None
+
+    @property
+    def snapshot(self) -> Optional[omada_client.Accesspoints]:
+        """The latest Accesspoints snapshot or None if no crawl succeeded yet."""
+        return self._snapshot
+
+    def wait_for_snapshot(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until the first snapshot is available."""
+        return self._ready.wait(timeout)
+
+    def get_snapshot(self, max_staleness: float) -> Optional[omada_client.Accesspoints]:
+        """Returns a snapshot not older than max_staleness seconds if possible.
+
+        An older snapshot triggers a refresh, shared with any crawl already in
+        flight. If the crawl fails the previous snapshot is returned."""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.age <= max_staleness:
+            return snapshot
+        self.refresh()
+        return self._snapshot
+
+    def refresh(self):
+        """This method runs a crawl, or waits for the one already in flight."""
+        with self._flight_lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = threading.Event()
+        if not leader:
+            flight.wait()
+            return
+        try:
+            self._crawl()
+        finally:
+            with self._flight_lock:
+                self._flight = None
+            flight.set()
+
+    def _crawl(self) -> Optional[omada_client.Accesspoints]:
+        """This method crawls the controller once and publishes the result.
+
+        A failed crawl is logged and returns None, the previous snapshot stays
+        in place. A changed configuration file is picked up before the crawl,
+        if it is broken the previous configuration is used."""
+        try:
+            previous = config.get_config()
+            if config.reload_config():
+                logger.info("Reloaded configuration from %s" % config.config_path())
+                changed = config.restart_required(previous, config.get_config())
+                if changed:
+                    logger.warning(
+                        "Restart to apply the changed settings: %s" % ", ".join(changed)
+                    )
+        except Exception as ex:
+            logger.error("Error: %s" % (ex))
+        if self._trace_size > 0:
+            tracing.start_trace("crawl")
+        try:
+            aps = omada_client.get_infos(config.get_config())
+        except Exception as ex:
+            logger.error("Error: %s" % (ex))
+            aps = None
+        finally:
+            trace = tracing.finish_trace()
+            if trace is not None:
+                self.traces.add(trace)
+        if aps is None:
+            logger.warning("Crawl failed, keeping previous snapshot")
+            return None
+        aps = dataclasses.replace(aps, generation=next(self._generations))
+        # Swapping the reference is atomic, readers see either the old or the new snapshot.
+        self._snapshot = aps
+        self._ready.set()
+        logger.info(
+            "Refreshed snapshot with %d APs in %.2fs using %d page requests (%s)"
+            % (
+                len(aps.accesspoints),
+                aps.refresh_duration,
+                aps.page_requests,
+                ", ".join(
+                    "%s: %d" % item for item in sorted(aps.endpoint_requests.items())
+                ),
+            )
+        )
+        return aps
+
+    def run(self):
+        if self._interval <= 0:
+            return
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as ex:
+                logger.error("Error: %s" % (ex))
+            elapsed = time.monotonic() - started
+            self._stopped.wait(max(self._interval - elapsed, 0))
+
+    def stop(self):
+        """This method stops the collector after the current crawl."""
+        self._stopped.set()
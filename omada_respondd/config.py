@@ -1,14 +1,33 @@
 #!/usr/bin/env python3
-from functools import lru_cache
 import yaml
 import os
-from typing import List, Dict, Any, Union, Optional
+from typing import List, Dict, Any, Union, Optional, Tuple
 import dataclasses
 import sys
+import threading
 
 OMADA_RESPONDD_CONFIG_OS_ENV = "OMADA_RESPONDD_CONFIG_FILE"
 OMADA_RESPONDD_CONFIG_DEFAULT_LOCATION = "./OMADA_respondd.yaml"
 
+# Settings that take effect with the next crawl after a reload. Changes to all
+# other settings are only picked up by a restart. A reloaded max_workers sizes
+# the worker pool of the next crawl, the HTTP connection pool keeps its size
+# until a restart.
+RELOADABLE_SETTINGS = (
+    "ssid_regex",
+    "offloader_mac",
+    "nodelist",
+    "nodelist_refresh_interval",
+    "nodelist_streaming",
+    "fallback_domain",
+    "incremental",
+    "client_page_size",
+    "max_workers",
+)
+
+# Seconds the responses of the controller endpoints are cached, 0 disables caching.
+DEFAULT_CACHE_TTL = {"settings": 86400, "devices": 0, "eap": 3600, "clients": 0}
+
 
 class Error(Exception):
     """Base Exception handling class."""
@@ -18,6 +37,10 @@ class ConfigFileNotFoundError(Error):
     """File could not be found on disk."""
 
 
+class InvalidConfigError(Error):
+    """The configuration contains values that can't work together."""
+
+
 @dataclasses.dataclass
 class Config:
     """A representation of the configuration file.
@@ -26,6 +49,33 @@ class Config:
         controller_port: The OMADA Controller port.
         username: The username for OMADA controller.
         password: The password for OMADA controller.
+        server_mode: How requests are served, "blocking" (one at a time) or "asyncio".
+        poll_interval: Seconds between two background crawls of the controller, 0 to only crawl on request (requires max_staleness).
+        max_staleness: If set, requests for an older snapshot trigger a shared refresh first.
+        send_batch_size: The number of datagrams handed to the kernel with one sendmmsg call.
+        send_pacing: Seconds to pause between two batches of datagrams sent to a requester.
+        max_workers: The number of sites and APs that are fetched concurrently, the connection pool only follows on restart.
+        rate_limit: The maximum number of requests per second sent to the controller.
+        http_connect_timeout: Seconds to wait for a connection to the controller.
+        http_read_timeout: Seconds to wait for the controller to answer a request.
+        http_retries: How often a failed GET request to the controller is retried.
+        http_backoff: Base delay in seconds of the jittered exponential backoff between retries.
+        metrics_address: The address the metrics endpoint listens on.
+        metrics_port: If set, metrics are served in the Prometheus text format on /metrics.
+        trace_buffer_size: The number of recent crawls whose traces are kept, 0 disables tracing.
+        trace_file: If set, SIGUSR1 writes the slowest trace to this JSON file instead of the log.
+        incremental: Only fetch the details of APs that changed since the last crawl.
+        cache_ttl: Seconds the responses of each controller endpoint are cached.
+        cache_size: The maximum number of cached responses per endpoint, the eap cache grows to the number of APs.
+        client_page_size: The page size used to fetch all clients of a site at once.
+        page_size: The default page size for paged controller requests.
+        adaptive_paging: Whether to refetch paged results in as few pages as possible.
+        max_page_size: The largest page size used by adaptive paging.
+        nodelist_refresh_interval: Seconds between two revalidations of the nodelist.
+        nodelist_streaming: Whether to parse the nodelist incrementally with ijson.
+        geocode_cache_file: The JSON file in which geocoded SNMP locations are kept.
+        geocode_ttl: Seconds after which a geocoded location is looked up again.
+        geocode_negative_ttl: Seconds after which a failed lookup is retried.
     """
 
     controller_url: str
@@ -47,6 +97,44 @@ class Config:
 
     ssl_verify: bool = True
 
+    server_mode: str = "blocking"
+    poll_interval: int = 60
+    max_staleness: Optional[int] = None
+    send_batch_size: int = 64
+    send_pacing: float = 0.0
+    max_workers: int = 4
+    rate_limit: Optional[float] = None
+    http_connect_timeout: float = 5
+    http_read_timeout: float = 30
+    http_retries: int = 2
+    http_backoff: float = 0.5
+    metrics_address: str = "::"
+    metrics_port: Optional[int] = None
+    trace_buffer_size: int = 2
+    trace_file: Optional[str] = None
+    incremental: bool = False
+    cache_ttl: Dict[str, int] = dataclasses.field(
+        default_factory=lambda: dict(DEFAULT_CACHE_TTL)
+    )
+    cache_size: int = 4096
+    client_page_size: int = 1000
+    page_size: int = 100
+    adaptive_paging: bool = False
+    max_page_size: int = 1000
+
+    nodelist_refresh_interval: int = 300
+    nodelist_streaming: bool = False
+
+    geocode_cache_file: str = "./geocode_cache.json"
+    geocode_ttl: int = 30 * 24 * 60 * 60
+    geocode_negative_ttl: int = 24 * 60 * 60
+
+    def __post_init__(self):
+        if self.poll_interval <= 0 and self.max_staleness is None:
+            raise InvalidConfigError(
+                "poll_interval 0 requires max_staleness, otherwise nothing is ever crawled"
+            )
+
     @classmethod
     def from_dict(cls, cfg: Dict[str, str]) -> "Config":
         """Creates a Config object from a configuration file.
@@ -73,10 +161,42 @@ class Config:
             interface=cfg["interface"],
             verbose=cfg["verbose"],
             fallback_domain=cfg.get("fallback_domain", "omada_respondd_fallback"),
+            server_mode=cfg.get("server_mode", "blocking"),
+            poll_interval=cfg.get("poll_interval", 60),
+            max_staleness=cfg.get("max_staleness", None),
+            send_batch_size=cfg.get("send_batch_size", 64),
+            send_pacing=cfg.get("send_pacing", 0.0),
+            max_workers=cfg.get("max_workers", 4),
+            rate_limit=cfg.get("rate_limit", None),
+            http_connect_timeout=cfg.get("http_connect_timeout", 5),
+            http_read_timeout=cfg.get("http_read_timeout", 30),
+            http_retries=cfg.get("http_retries", 2),
+            http_backoff=cfg.get("http_backoff", 0.5),
+            metrics_address=cfg.get("metrics_address", "::"),
+            metrics_port=cfg.get("metrics_port", None),
+            trace_buffer_size=cfg.get("trace_buffer_size", 2),
+            trace_file=cfg.get("trace_file", None),
+            incremental=cfg.get("incremental", False),
+            cache_ttl={**DEFAULT_CACHE_TTL, **cfg.get("cache_ttl", {})},
+            cache_size=cfg.get("cache_size", 4096),
+            client_page_size=cfg.get("client_page_size", 1000),
+            page_size=cfg.get("page_size", 100),
+            adaptive_paging=cfg.get("adaptive_paging", False),
+            max_page_size=cfg.get("max_page_size", 1000),
+            nodelist_refresh_interval=cfg.get("nodelist_refresh_interval", 300),
+            nodelist_streaming=cfg.get("nodelist_streaming", False),
+            geocode_cache_file=cfg.get("geocode_cache_file", "./geocode_cache.json"),
+            geocode_ttl=cfg.get("geocode_ttl", 30 * 24 * 60 * 60),
+            geocode_negative_ttl=cfg.get("geocode_negative_ttl", 24 * 60 * 60),
         )
 
 
-@lru_cache(maxsize=10)
+# The loaded configuration as one (file identity, parsed dict, Config) tuple, so
+# that a reload swaps all of it with a single assignment.
+_loaded: Optional[Tuple[Tuple[int, int], Dict[str, Any], Config]] = None
+_reload_lock = threading.Lock()
+
+
 def fetch_from_config(key: str) -> Optional[Union[Dict[str, Any], List[str]]]:
     """Fetches a specific key from configuration.
     Arguments:
@@ -84,7 +204,53 @@ def fetch_from_config(key: str) -> Optional[Union[Dict[str, Any], List[str]]]:
     Returns:
         The config value associated with the key
     """
-    return load_config().get(key)
+    return get_raw_config().get(key)
+
+
+def get_config() -> Config:
+    """Returns the shared Config, the file is only read on first use.
+    Returns:
+        The Config object of the last successful (re)load.
+    """
+    if _loaded is None:
+        _load_or_exit()
+    return _loaded[2]
+
+
+def get_raw_config() -> Dict[str, Any]:
+    """Returns the parsed configuration file the shared Config was created from."""
+    if _loaded is None:
+        _load_or_exit()
+    return _loaded[1]
+
+
+def reload_config() -> bool:
+    """Reloads the configuration if the inode or mtime of the file changed.
+
+    A file that fails to parse or lint raises and the previous configuration
+    stays in use. Callers holding the old Config keep using it until they ask
+    for the current one again.
+    Returns:
+        True if a new configuration was loaded.
+    """
+    global _loaded
+    with _reload_lock:
+        identity = _file_identity()
+        if _loaded is not None and _loaded[0] == identity:
+            return False
+        config = yaml.safe_load(fetch_config_from_disk())
+        _loaded = (identity, config, Config.from_dict(config))
+        return True
+
+
+def restart_required(old: Config, new: Config) -> List[str]:
+    """Returns the names of the changed settings that only take effect after a restart."""
+    return [
+        field.name
+        for field in dataclasses.fields(Config)
+        if field.name not in RELOADABLE_SETTINGS
+        and getattr(old, field.name) != getattr(new, field.name)
+    ]
 
 
 def load_config() -> Dict[str, str]:
@@ -101,11 +267,35 @@ def load_config() -> Dict[str, str]:
     try:
         _ = Config.from_dict(config)
         return config
-    except (KeyError, TypeError) as e:
+    except (KeyError, TypeError, InvalidConfigError) as e:
         print("Failed to lint file: %s", e)
         sys.exit(2)
 
 
+def _load_or_exit():
+    global _loaded
+    with _reload_lock:
+        if _loaded is None:
+            identity = _file_identity()
+            config = load_config()
+            _loaded = (identity, config, Config.from_dict(config))
+
+
+def config_path() -> str:
+    """Returns the path of the configuration file."""
+    return os.environ.get(
+        OMADA_RESPONDD_CONFIG_OS_ENV, OMADA_RESPONDD_CONFIG_DEFAULT_LOCATION
+    )
+
+
+def _file_identity() -> Tuple[int, int]:
+    try:
+        stat = os.stat(config_path())
+    except FileNotFoundError:
+        return (0, 0)
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
 def fetch_config_from_disk() -> str:
     """Fetches config file from disk and returns as string.
     Raises:
@@ -113,9 +303,7 @@ def fetch_config_from_disk() -> str:
     Returns:
         The file contents as string.
     """
-    config_file = os.environ.get(
-        OMADA_RESPONDD_CONFIG_OS_ENV, OMADA_RESPONDD_CONFIG_DEFAULT_LOCATION
-    )
+    config_file = config_path()
     try:
         with open(config_file, "r") as stream:
             return stream.read()
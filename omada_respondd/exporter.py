@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from omada_respondd import config
+from omada_respondd import logger
+from omada_respondd import omada_client
+from omada_respondd.metrics import format_header, format_histogram, format_sample
+from typing import List
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render(client) -> str:
+    """This function returns the metrics of a ResponddClient in the Prometheus text format."""
+    lines: List[str] = []
+
+    def gauge(name, help, samples):
+        lines.extend(format_header(name, "gauge", help))
+        lines.extend(format_sample(name, value, labels) for labels, value in samples)
+
+    def counter(name, help, samples):
+        lines.extend(format_header(name, "counter", help))
+        lines.extend(format_sample(name, value, labels) for labels, value in samples)
+
+    def histogram(name, help, histograms):
+        lines.extend(format_header(name, "histogram", help))
+        for labels, value in histograms:
+            lines.extend(format_histogram(name, value, labels))
+
+    snapshot = client._collector.snapshot
+    if snapshot is not None:
+        gauge(
+            "omada_respondd_snapshot_age_seconds",
+            "Seconds since the current snapshot was taken.",
+            [({}, snapshot.age)],
+        )
+        gauge(
+            "omada_respondd_snapshot_generation",
+            "Number of the current snapshot.",
+            [({}, snapshot.generation)],
+        )
+        gauge(
+            "omada_respondd_accesspoints",
+            "APs in the current snapshot.",
+            [({}, len(snapshot.accesspoints))],
+        )
+        gauge(
+            "omada_respondd_crawl_duration_seconds",
+            "Duration of the crawl of the current snapshot.",
+            [({}, snapshot.refresh_duration)],
+        )
+        gauge(
+            "omada_respondd_crawl_phase_seconds",
+            "Seconds the crawl of the current snapshot spent per site and phase.",
+            [
+                ({"site": site, "phase": phase}, duration)
+                for (site, phase), duration in sorted(snapshot.phase_durations.items())
+            ],
+        )
+        gauge(
+            "omada_respondd_crawl_page_requests",
+            "Paged controller requests of the crawl of the current snapshot.",
+            [({}, snapshot.page_requests)],
+        )
+        gauge(
+            "omada_respondd_crawl_endpoint_requests",
+            "Controller requests of the crawl of the current snapshot per endpoint.",
+            [
+                ({"endpoint": endpoint}, count)
+                for endpoint, count in sorted(snapshot.endpoint_requests.items())
+            ],
+        )
+
+    histogram(
+        "omada_respondd_omada_request_seconds",
+        "Latency of the requests to the Omada controller per endpoint.",
+        [
+            ({"endpoint": endpoint}, latency)
+            for endpoint, latency in sorted(omada_client.get_endpoint_latency().items())
+        ],
+    )
+
+    caches = omada_client.get_caches(config.get_config()).values()
+    counter(
+        "omada_respondd_cache_hits_total",
+        "Lookups answered from the response cache of an endpoint.",
+        [({"endpoint": cache.name}, cache.hits) for cache in caches],
+    )
+    counter(
+        "omada_respondd_cache_misses_total",
+        "Lookups the response cache of an endpoint could not answer.",
+        [({"endpoint": cache.name}, cache.misses) for cache in caches],
+    )
+    counter(
+        "omada_respondd_cache_evictions_total",
+        "Entries evicted from the response cache of an endpoint because it was full.",
+        [({"endpoint": cache.name}, cache.evictions) for cache in caches],
+    )
+    gauge(
+        "omada_respondd_cache_entries",
+        "Entries in the response cache of an endpoint.",
+        [({"endpoint": cache.name}, len(cache)) for cache in caches],
+    )
+
+    counter(
+        "omada_respondd_requests_total",
+        "Answered respondd requests.",
+        [({}, client.requestCount.value)],
+    )
+    histogram(
+        "omada_respondd_request_seconds",
+        "Time from receiving a respondd request to sending its responses.",
+        [({}, client.requestLatency)],
+    )
+    histogram(
+        "omada_respondd_response_build_seconds",
+        "Time spent building the responses to a request for a new snapshot.",
+        [({}, client.buildLatency)],
+    )
+    histogram(
+        "omada_respondd_response_send_seconds",
+        "Time spent sending the responses to one requester.",
+        [({}, client.sendLatency)],
+    )
+    counter(
+        "omada_respondd_datagrams_sent_total",
+        "Response datagrams sent.",
+        [({}, client.datagramsSent.value)],
+    )
+    counter(
+        "omada_respondd_datagram_bytes_sent_total",
+        "Bytes of the response datagrams sent.",
+        [({}, client.bytesSent.value)],
+    )
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer(threading.Thread):
+    """This class serves the metrics of a ResponddClient over HTTP on /metrics."""
+
+    def __init__(self, client, address: str, port: int):
+        super().__init__(name="metrics-server", daemon=True)
+        family = socket.AF_INET6 if ":" in address else socket.AF_INET
+
+        class Server(ThreadingHTTPServer):
+            address_family = family
+            daemon_threads = True
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                try:
+                    body = render(client).encode("UTF-8")
+                except Exception as ex:
+                    logger.error("Error: %s" % (ex))
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics request: " + format % args)
+
+        self._server = Server((address, port), Handler)
+
+    def run(self):
+        logger.info("Serving metrics on port %d" % self._server.server_address[1])
+        self._server.serve_forever()
+
+    def stop(self):
+        """This method stops serving metrics."""
+        self._server.shutdown()
+        self._server.server_close()
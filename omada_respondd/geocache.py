@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import dataclasses
+import json
+import os
+import queue
+import threading
+import time
+
+from omada_respondd import logger
+from typing import Dict, Optional, Tuple
+
+
+@dataclasses.dataclass
+class GeocodeEntry:
+    """This class contains a cached geocoding result.
+    Attributes:
+        latitude: The latitude of the address or None if it could not be resolved.
+        longitude: The longitude of the address or None if it could not be resolved.
+        stored_at: The time.time() timestamp at which the result was stored."""
+
+    latitude: Optional[float]
+    longitude: Optional[float]
+    stored_at: float
+
+    @property
+    def found(self) -> bool:
+        """Whether the address could be resolved."""
+        return self.latitude is not None and self.longitude is not None
+
+
+class GeocodeCache:
+    """This class keeps address lookups in a JSON file so they survive restarts.
+
+    Failed lookups are cached as well, with their own (usually shorter) TTL."""
+
+    def __init__(self, path: str, ttl: int, negative_ttl: int):
+        self._path = path
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, GeocodeEntry] = self._load()
+
+    def _load(self) -> Dict[str, GeocodeEntry]:
+        try:
+            with open(self._path, "r") as stream:
+                raw = json.load(stream)
+            return {
+                address: GeocodeEntry(latitude=lat, longitude=lon, stored_at=stored_at)
+                for address, (lat, lon, stored_at) in raw.items()
+            }
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, TypeError, AttributeError) as ex:
+            logger.warning("Could not read geocode cache %s: %s" % (self._path, ex))
+            return {}
+
+    def _save(self):
+        raw = {
+            address: [entry.latitude, entry.longitude, entry.stored_at]
+            for address, entry in self._entries.items()
+        }
+        tmp_path = self._path + ".tmp"
+        try:
+            with open(tmp_path, "w") as stream:
+                json.dump(raw, stream)
+            os.replace(tmp_path, self._path)
+        except OSError as ex:
+            logger.warning("Could not write geocode cache %s: %s" % (self._path, ex))
+
+    def get(self, address: str) -> Optional[GeocodeEntry]:
+        """Returns the cached entry for an address, even if it is expired."""
+        with self._lock:
+            return self._entries.get(address)
+
+    def is_expired(self, entry: GeocodeEntry) -> bool:
+        """Whether an entry should be looked up again."""
+        ttl = self._ttl if entry.found else self._negative_ttl
+        return time.time() - entry.stored_at > ttl
+
+    def put(
+        self, address: str, latitude: Optional[float], longitude: Optional[float]
+    ) -> GeocodeEntry:
+        """Stores a lookup result, None coordinates mark a failed lookup."""
+        entry = GeocodeEntry(
+            latitude=latitude, longitude=longitude, stored_at=time.time()
+        )
+        with self._lock:
+            self._entries[address] = entry
+            self._save()
+        return entry
+
+
+class GeocodeWorker(threading.Thread):
+    """This class resolves addresses off the crawl path.
+
+    Addresses are queued and looked up one at a time, at most one request per
+    `interval` seconds as required by the Nominatim usage policy. Failed lookups
+    are retried `max_retries` times with exponential backoff."""
+
+    def __init__(
+        self,
+        app,
+        cache: GeocodeCache,
+        interval: float = 1.0,
+        max_retries: int = 3,
+        backoff: float = 2.0,
+    ):
+        super().__init__(name="geocode-worker", daemon=True)
+        self._app = app
+        self._cache = cache
+        self._interval = interval
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._last_request = 0.0
+
+    def lookup(self, address: str) -> Optional[Tuple[float, float]]:
+        """Returns the cached coordinates of an address without blocking.
+
+        Unknown and expired addresses are queued for a lookup, until it resolves
+        the previous result or None is returned."""
+        entry = self._cache.get(address)
+        if entry is None or self._cache.is_expired(entry):
+            self.enqueue(address)
+        if entry is not None and entry.found:
+            return entry.latitude, entry.longitude
+        return None
+
+    def enqueue(self, address: str):
+        """Queues an address for a lookup unless it is already queued."""
+        with self._pending_lock:
+            if address in self._pending:
+                return
+            self._pending.add(address)
+        self._queue.put(address)
+
+    def run(self):
+        while True:
+            address = self._queue.get()
+            try:
+                self._resolve(address)
+            except Exception as ex:
+                logger.error("Error: %s" % (ex))
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(address)
+
+    def _wait_for_slot(self):
+        delay = self._last_request + self._interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._last_request = time.monotonic()
+
+    def _resolve(self, address: str):
+        for attempt in range(self._max_retries + 1):
+            self._wait_for_slot()
+            try:
+                geocode = self._app.geocode(address)
+            except Exception as ex:
+                if attempt == self._max_retries:
+                    logger.warning("Giving up geocoding %s: %s" % (address, ex))
+                    return
+                time.sleep(self._backoff * 2**attempt)
+                continue
+
+            if geocode is None:
+                self._cache.put(address, None, None)
+            else:
+                self._cache.put(
+                    address, float(geocode.raw["lat"]), float(geocode.raw["lon"])
+                )
+            return
@@ -6,9 +6,8 @@ from logging import error as error
 from logging import critical as critical
 from logging import debug as debug
 from logging import config
-import yaml
 import os.path
-from omada_respondd.config import OMADA_RESPONDD_CONFIG_DEFAULT_LOCATION
+from omada_respondd import config as omada_respondd_config
 
 _LOGGING_DEFAULT_CONFIG = {
     "version": 1,
@@ -32,14 +31,14 @@ def fetch_logging_configuration():
 
     If the config exists, then we check to see if the key 'logging_config' is set. If it is, we return this configuration.
     Otherwise, we return the default configuration (_LOGGING_DEFAULT_CONFIG).
+    The file is parsed once and shared with the rest of omada_respondd.
 
     Returns:
         Logging configuration.
     """
     logging_cfg = dict()
-    if os.path.isfile(OMADA_RESPONDD_CONFIG_DEFAULT_LOCATION):
-        with open(OMADA_RESPONDD_CONFIG_DEFAULT_LOCATION) as cfg_file:
-            logging_cfg = yaml.load(cfg_file, Loader=yaml.FullLoader)
+    if os.path.isfile(omada_respondd_config.config_path()):
+        logging_cfg = omada_respondd_config.get_raw_config()
     if logging_cfg.get("logging_config"):
         return logging_cfg.get("logging_config")
     return _LOGGING_DEFAULT_CONFIG
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import bisect
+import threading
+
+from typing import Dict, List, Sequence
+
+# Upper bounds in seconds, from sub-millisecond responses to slow controller calls.
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class Histogram:
+    """This class counts observations in cumulative buckets like a Prometheus histogram."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts: List[int] = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Records one observation."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def cumulative(self) -> List[int]:
+        """Returns the number of observations less or equal to each bucket bound, +Inf last."""
+        with self._lock:
+            counts = list(self._counts)
+        total = 0
+        cumulative = []
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the q-quantile."""
+        cumulative = self.cumulative()
+        if cumulative[-1] == 0:
+            return 0.0
+        rank = q * cumulative[-1]
+        for bound, count in zip(self.buckets, cumulative):
+            if count >= rank:
+                return bound
+        return float("inf")
+
+
+class Counter:
+    """This class counts events, like a Prometheus counter."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        """Adds amount to the counter."""
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '%s="%s"'
+        % (
+            name,
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_header(name: str, kind: str, help: str) -> List[str]:
+    """Returns the HELP and TYPE lines of a metric family in the text exposition format."""
+    return ["# HELP %s %s" % (name, help), "# TYPE %s %s" % (name, kind)]
+
+
+def format_sample(name: str, value: float, labels: Dict[str, str] = {}) -> str:
+    """Returns one sample in the text exposition format."""
+    return "%s%s %s" % (name, _format_labels(labels), repr(float(value)))
+
+
+def format_histogram(
+    name: str, histogram: Histogram, labels: Dict[str, str] = {}
+) -> List[str]:
+    """Returns the bucket, sum and count samples of a histogram."""
+    lines = []
+    bounds = [repr(float(bound)) for bound in histogram.buckets] + ["+Inf"]
+    for bound, count in zip(bounds, histogram.cumulative()):
+        lines.append(format_sample(name + "_bucket", count, dict(labels, le=bound)))
+    lines.append(format_sample(name + "_sum", histogram.sum, labels))
+    lines.append(format_sample(name + "_count", histogram.count, labels))
+    return lines
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import dataclasses
+import threading
+
+from requests import get as rget
+from omada_respondd import logger
+from typing import Dict, Iterable, Optional, Set
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+@dataclasses.dataclass(frozen=True)
+class NodelistEntry:
+    """This class contains the fields of a meshviewer node used for the APs.
+    Attributes:
+        gateway: The MAC of the IPv4 gateway of the node.
+        gateway6: The MAC of the IPv6 gateway of the node.
+        domain: The domain code of the node."""
+
+    gateway: Optional[str]
+    gateway6: Optional[str]
+    domain: Optional[str]
+
+
+class Nodelist(threading.Thread):
+    """This class keeps a MAC-keyed index of the meshviewer nodelist.
+
+    The nodelist is revalidated every `interval` seconds with ETag and
+    If-Modified-Since, so an unchanged nodelist is not downloaded again.
+    If `macs` is given only those nodes are kept. With `streaming` the nodes
+    are parsed one by one with ijson instead of loading the whole document."""
+
+    def __init__(
+        self,
+        url: str,
+        interval: int,
+        macs: Optional[Set[str]] = None,
+        streaming: bool = False,
+    ):
+        super().__init__(name="nodelist", daemon=True)
+        self._url = url
+        self._interval = interval
+        self._macs = macs
+        self._streaming = streaming
+        if streaming and ijson is None:
+            logger.warning("ijson is not installed, parsing the nodelist at once")
+            self._streaming = False
+        self._nodes: Dict[str, NodelistEntry] = {}
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._stopped = threading.Event()
+
+    def get(self, mac: str) -> Optional[NodelistEntry]:
+        """Returns the entry of the node with the given MAC address."""
+        return self._nodes.get(mac)
+
+    def refresh(self):
+        """This method downloads the nodelist if it changed and rebuilds the index."""
+        headers = {}
+        if self._etag is not None:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified is not None:
+            headers["If-Modified-Since"] = self._last_modified
+
+        response = rget(self._url, headers=headers, timeout=30, stream=self._streaming)
+        if response.status_code == 304:
+            logger.debug("Nodelist %s not modified" % self._url)
+            return
+        response.raise_for_status()
+
+        # Swapping the reference is atomic, readers see either the old or the new index.
+        self._nodes = {
+            node["mac"]: NodelistEntry(
+                gateway=node.get("gateway", None),
+                gateway6=node.get("gateway6", None),
+                domain=node.get("domain", None),
+            )
+            for node in self._parse(response)
+            if "mac" in node and (self._macs is None or node["mac"] in self._macs)
+        }
+        self._etag = response.headers.get("ETag", None)
+        self._last_modified = response.headers.get("Last-Modified", None)
+        logger.info("Indexed %d nodes from %s" % (len(self._nodes), self._url))
+
+    def _parse(self, response) -> Iterable[dict]:
+        if not self._streaming:
+            return response.json().get("nodes", [])
+        response.raw.decode_content = True
+        return ijson.items(response.raw, "nodes.item")
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.refresh()
+            except Exception as ex:
+                logger.error("Error: %s" % (ex))
+
+    def stop(self):
+        """This method stops the periodic refresh."""
+        self._stopped.set()
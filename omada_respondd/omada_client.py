@@ -1,25 +1,48 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
 from geopy.point import Point
 from omada import Omada
-from typing import List, Optional
+from typing import Dict, Optional, Tuple
 from geopy.geocoders import Nominatim
 from omada_respondd import config
-from requests import get as rget
+from omada_respondd.geocache import GeocodeCache, GeocodeWorker
+from omada_respondd.metrics import Histogram
+from omada_respondd.nodelist import Nodelist
+from omada_respondd.ttlcache import TTLCache
 from omada_respondd import logger
+from omada_respondd import tracing
 import time
+import collections
+import contextlib
 import dataclasses
 import re
+import threading
 
-ffnodes = None
+_omada = None
+_nodelist = None
+_nodelist_settings = None
+_geocoder = None
+_caches = None
+_endpoint_latency: Dict[str, Histogram] = {}
+_endpoint_latency_lock = threading.Lock()
 
+# The controller endpoints whose responses can be cached.
+CACHED_ENDPOINTS = ("settings", "devices", "eap", "clients")
 
-@dataclasses.dataclass
+# Fields of the device list that change the details of an AP when they change.
+_DETAIL_FINGERPRINT = ("name", "model", "version", "status")
+# Fast-changing fields that are taken from the device list instead of cached details.
+_FAST_FIELDS = ("uptimeLong", "cpuUtil", "memUtil")
+
+
+@dataclasses.dataclass(slots=True)
 class Accesspoint:
     """This class contains the information of an AP.
     Attributes:
         name: The name of the AP (alias in the unifi controller).
-        mac: The MAC address of the AP.
+        mac: The MAC address of the AP, lower case and colon separated.
+        node_id: The node id of the AP. This is the same as the MAC address (without :).
         snmp_location: The location of the AP (SNMP location in the unifi controller).
         client_count: The number of clients connected to the AP.
         client_count24: The number of clients connected to the AP via 2,4 GHz.
@@ -39,6 +62,7 @@ class Accesspoint:
 
     name: str
     mac: str
+    node_id: str
     snmp_location: str
     client_count: int
     client_count24: int
@@ -58,67 +82,298 @@ class Accesspoint:
     gateway: str
     gateway6: str
     gateway_nexthop: str
-    neighbour_macs: List[str]
+    neighbour_macs: Tuple[Optional[str], ...]
     domain_code: str
     # autoupdater: str
     frequency24: Optional[int]
     frequency5: Optional[int]
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class Accesspoints:
-    """This class contains the information of all APs.
+    """This class contains an immutable snapshot of the information of all APs.
     Attributes:
-        accesspoints: A list of Accesspoint objects."""
+        accesspoints: A tuple of Accesspoint objects.
+        collected_at: The time.monotonic() timestamp at which the snapshot was taken.
+        refresh_duration: The number of seconds the crawl for this snapshot took.
+        page_requests: The number of paged controller requests the crawl needed.
+        endpoint_requests: The number of controller requests of the crawl per endpoint.
+        phase_durations: The seconds the crawl spent per (site, phase), site is empty
+            for phases that don't belong to a site.
+        generation: A number identifying the snapshot, increased by every refresh."""
+
+    accesspoints: Tuple[Accesspoint, ...]
+    collected_at: float = 0.0
+    refresh_duration: float = 0.0
+    page_requests: int = 0
+    endpoint_requests: Dict[str, int] = dataclasses.field(default_factory=dict)
+    phase_durations: Dict[Tuple[str, str], float] = dataclasses.field(
+        default_factory=dict
+    )
+    generation: int = 0
 
-    accesspoints: List[Accesspoint]
+    @property
+    def age(self) -> float:
+        """The number of seconds since the snapshot was taken."""
+        return time.monotonic() - self.collected_at
 
 
-def get_client_count_for_ap(clients, cfg):
-    """This function returns the number total clients, 2,4Ghz clients and 5Ghz clients connected to an AP with Freifunk SSID."""
-    client5_count = 0
-    client24_count = 0
-    for client in clients:
-        if re.search(cfg.ssid_regex, client.get("ssid", ""), re.IGNORECASE):
+@dataclasses.dataclass
+class ClientStats:
+    """This class contains the Freifunk client counters of an AP.
+    Attributes:
+        total: The number of clients connected with a Freifunk SSID.
+        count24: The number of those clients connected via 2,4 GHz.
+        count5: The number of those clients connected via 5 GHz.
+        tx: The bytes sent by those clients.
+        rx: The bytes received by those clients."""
+
+    total: int = 0
+    count24: int = 0
+    count5: int = 0
+    tx: int = 0
+    rx: int = 0
+
+
+_NO_CLIENTS = ClientStats()
+
+
+@dataclasses.dataclass
+class ApDetails:
+    """This class contains the cached details of an AP for incremental crawls.
+    Attributes:
+        details: The response of getSiteAP.
+        fingerprint: The values of the _DETAIL_FINGERPRINT fields when fetched.
+        uptime: The uptime of the AP in the device list of the last crawl."""
+
+    details: dict
+    fingerprint: Tuple
+    uptime: int
+
+
+class EndpointCounter:
+    """This class counts the controller requests of a crawl per endpoint.
+
+    The latency of every request is recorded in the histogram of its endpoint,
+    which is kept across crawls, see get_endpoint_latency. The time spent per
+    site and crawl phase is summed up as well, a request counts towards the
+    phase named like its endpoint."""
+
+    def __init__(self):
+        self._counts = collections.Counter()
+        self._durations = collections.Counter()
+        self._lock = threading.Lock()
+
+    def call(self, endpoint: str, func, *args, **kwargs):
+        """Calls func, counting it as a request to the given endpoint."""
+        with self._lock:
+            self._counts[endpoint] += 1
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            _latency_histogram(endpoint).observe(duration)
+            self.add_duration(kwargs.get("site", ""), endpoint, duration)
+            tracing.record(endpoint, start, duration, **_site_attribute(kwargs))
+
+    @contextlib.contextmanager
+    def timed(self, site: str, phase: str):
+        """Adds the time spent in the with block to the given site and phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.add_duration(site, phase, duration)
+            tracing.record(phase, start, duration, **_site_attribute({"site": site}))
+
+    def add_requests(self, endpoint: str, count: int):
+        """Counts further requests made by a single call, like the pages of a paged one."""
+        with self._lock:
+            self._counts[endpoint] += count
+
+    def add_duration(self, site: str, phase: str, duration: float):
+        with self._lock:
+            self._durations[(site, phase)] += duration
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def durations(self) -> Dict[Tuple[str, str], float]:
+        with self._lock:
+            return dict(self._durations)
+
+
+def _site_attribute(kwargs):
+    site = kwargs.get("site", None)
+    return {"site": site} if site else {}
+
+
+# Site keys and MACs are replaced in the paths of traced requests, so that the
+# requests to the same endpoint add up in the breakdown of a trace.
+_TRACE_PATH_PATTERNS = (
+    (re.compile(r"/[0-9a-f]{24}(?=/|$)"), "/{key}"),
+    (re.compile(r"/[0-9A-Fa-f]{2}(?:[-:][0-9A-Fa-f]{2}){5}(?=/|$)"), "/{mac}"),
+)
+
+
+def _trace_request(method, path, params, started, duration, status):
+    """This function records a request of the Omada session as a span of the current trace."""
+    for pattern, replacement in _TRACE_PATH_PATTERNS:
+        path = pattern.sub(replacement, path)
+    attributes = {"status": status}
+    if "currentPage" in params:
+        attributes["page"] = params["currentPage"]
+    tracing.record("%s %s" % (method, path), started, duration, **attributes)
+
+
+def _latency_histogram(endpoint: str) -> Histogram:
+    with _endpoint_latency_lock:
+        histogram = _endpoint_latency.get(endpoint)
+        if histogram is None:
+            histogram = _endpoint_latency[endpoint] = Histogram()
+        return histogram
+
+
+def get_endpoint_latency() -> Dict[str, Histogram]:
+    """This function returns the request latency histograms of the controller endpoints."""
+    with _endpoint_latency_lock:
+        return dict(_endpoint_latency)
+
+
+class SsidClassifier:
+    """This class decides whether an SSID is a Freifunk SSID.
+
+    The regex is compiled once and the answer is remembered per SSID string,
+    a site only has a handful of distinct SSIDs."""
+
+    _MAX_MEMO = 1024
+
+    def __init__(self, ssid_regex: str):
+        self._pattern = re.compile(ssid_regex, re.IGNORECASE)
+        self._memo: Dict[str, bool] = {}
+
+    def matches(self, ssid: str) -> bool:
+        """Returns True if the SSID matches the configured ssid_regex."""
+        matched = self._memo.get(ssid)
+        if matched is None:
+            if len(self._memo) >= self._MAX_MEMO:
+                self._memo.clear()
+            matched = self._memo[ssid] = self._pattern.search(ssid) is not None
+        return matched
+
+    def index_clients(self, clients) -> Dict[str, ClientStats]:
+        """Counts the Freifunk clients and their band and traffic per AP MAC in a single pass."""
+        index: Dict[str, ClientStats] = {}
+        memo = self._memo
+        for client in clients:
+            ssid = client.get("ssid", "")
+            matched = memo.get(ssid)
+            if matched is None:
+                matched = self.matches(ssid)
+            if not matched:
+                continue
+            ap_mac = client.get("apMac", "").upper()
+            stats = index.get(ap_mac)
+            if stats is None:
+                stats = index[ap_mac] = ClientStats()
+            stats.total += 1
             if client.get("channel", 0) > 14:
-                client5_count += 1
+                stats.count5 += 1
             else:
-                client24_count += 1
-    return client24_count + client5_count, client24_count, client5_count
+                stats.count24 += 1
+            stats.tx += client.get("trafficUp", 0)
+            stats.rx += client.get("trafficDown", 0)
+        return index
+
 
+def normalize_mac(mac):
+    """This function converts an Omada MAC address (AA-BB-...) to the respondd form (aa:bb:...)."""
+    return mac.replace("-", ":").lower()
 
-def get_traffic_count_for_ap(clients, cfg):
+
+def get_client_count_for_ap(client_index, ap_mac):
     """This function returns the number total clients, 2,4Ghz clients and 5Ghz clients connected to an AP with Freifunk SSID."""
-    tx = 0
-    rx = 0
-    for client in clients:
-        if re.search(cfg.ssid_regex, client.get("ssid", ""), re.IGNORECASE):
-            tx += client.get("trafficUp", 0)
-            rx += client.get("trafficDown", 0)
+    stats = client_index.get(ap_mac.upper(), _NO_CLIENTS)
+    return stats.total, stats.count24, stats.count5
 
-    return tx, rx
 
+def get_traffic_count_for_ap(client_index, ap_mac):
+    """This function returns the traffic of the clients connected to an AP with Freifunk SSID."""
+    stats = client_index.get(ap_mac.upper(), _NO_CLIENTS)
+    return stats.tx, stats.rx
+
+
+def get_geocoder(cfg):
+    """This function returns the shared geocoding worker and starts it on first use."""
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = GeocodeWorker(
+            Nominatim(user_agent="ffmuc_respondd"),
+            GeocodeCache(
+                cfg.geocode_cache_file, cfg.geocode_ttl, cfg.geocode_negative_ttl
+            ),
+        )
+        _geocoder.start()
+    return _geocoder
 
-def get_location_by_address(address, app):
-    """This function returns latitude and longitude of a given address."""
+
+def get_caches(cfg):
+    """This function returns the response caches of the controller endpoints."""
+    global _caches
+    if _caches is None:
+        _caches = {
+            endpoint: TTLCache(endpoint, cfg.cache_ttl.get(endpoint, 0), cfg.cache_size)
+            for endpoint in CACHED_ENDPOINTS
+        }
+    return _caches
+
+
+def get_location_by_address(address, geocoder):
+    """This function returns latitude and longitude of a given address or None if it is not known yet.
+
+    Addresses which are no coordinates are resolved by the geocoder in the background.
+    """
     try:
         point = Point().from_string(address)
         return point.latitude, point.longitude
-    except:
+    except ValueError:
+        return geocoder.lookup(address)
+
+
+def get_nodelist(cfg):
+    """This function returns the shared nodelist index.
+
+    The first download happens right away so the first crawl already knows the offloaders.
+    If a reloaded configuration changed the nodelist or the offloader MACs, the
+    index is rebuilt.
+    """
+    global _nodelist, _nodelist_settings
+    settings = (
+        cfg.nodelist,
+        cfg.nodelist_refresh_interval,
+        frozenset(cfg.offloader_mac.values()),
+        cfg.nodelist_streaming,
+    )
+    if _nodelist is None or settings != _nodelist_settings:
+        if _nodelist is not None:
+            logger.info("Nodelist settings changed, rebuilding the index")
+            _nodelist.stop()
+        _nodelist = Nodelist(
+            cfg.nodelist,
+            cfg.nodelist_refresh_interval,
+            macs=set(cfg.offloader_mac.values()),
+            streaming=cfg.nodelist_streaming,
+        )
+        _nodelist_settings = settings
         try:
-            time.sleep(1)
-            geocode = app.geocode(address)
-            return geocode.raw["lat"], geocode.raw["lon"]
-        except:
-            return get_location_by_address(address)
-
-
-def scrape(url):
-    """returns remote json"""
-    try:
-        return rget(url).json()
-    except Exception as ex:
-        logger.error("Error: %s" % (ex))
+            _nodelist.refresh()
+        except Exception as ex:
+            logger.error("Error: %s" % (ex))
+        _nodelist.start()
+    return _nodelist
 
 
 def _to_float(value, default=0.0):
@@ -217,177 +472,382 @@ def get_ap_frequency(channelData: str) -> Optional[int]:
         )
 
 
-def get_infos():
-    """This function gathers all the information and returns a list of Accesspoint objects."""
-    cfg = config.Config.from_dict(config.load_config())
-    ffnodes = scrape(cfg.nodelist)
-    try:
-        cb = Omada(baseurl=cfg.controller_url, verify=cfg.ssl_verify, verbose=False)
-        cb.login(username=cfg.username, password=cfg.password)
-    except Exception as ex:
-        logger.error("Error: %s" % (ex))
-        return
-    geolookup = Nominatim(user_agent="ffmuc_respondd")
-    aps = Accesspoints(accesspoints=[])
-    for site in cb.getCurrentUser()["privilege"]["sites"]:
-        csite = Omada(
+def get_session(cfg):
+    """This function returns the shared, logged in Omada session.
+
+    The session can address every site the user has privileges for and logs in
+    again by itself once the controller expires the token."""
+    global _omada
+    if _omada is None:
+        omada = Omada(
             baseurl=cfg.controller_url,
-            site=site["name"],
             verify=cfg.ssl_verify,
             verbose=False,
+            rateLimit=cfg.rate_limit,
+            pageSize=cfg.page_size,
+            adaptivePaging=cfg.adaptive_paging,
+            maxPageSize=cfg.max_page_size,
+            timeout=(cfg.http_connect_timeout, cfg.http_read_timeout),
+            poolSize=cfg.max_workers,
+            retries=cfg.http_retries,
+            backoff=cfg.http_backoff,
         )
-        csite.login(
-            username=cfg.username,
-            password=cfg.password,
+        omada.requestObserver = _trace_request
+        omada.login(username=cfg.username, password=cfg.password)
+        _omada = omada
+    return _omada
+
+
+def _is_online_ap(ap):
+    """This function returns True if a device of the device list is an AP that is online."""
+    return (
+        ap.get("name", None) is not None
+        and (ap.get("status", 0) != 0 and ap.get("status", 0) != 20)
+        and ap.get("type") == "ap"
+    )
+
+
+def _contains_ssid(moreAPInfos, classifier):
+    """This function returns True if the AP broadcasts a Freifunk SSID."""
+    ssids = moreAPInfos.get("ssidOverrides", None)
+    containsSSID = False
+    if ssids is not None:
+        for ssid in ssids:
+            if classifier.matches(ssid.get("ssid", "")):
+                if (ssid.get("ssidEnabled"), False):
+                    containsSSID = True
+    return containsSSID
+
+
+def get_site_settings(cb, site, caches, endpoints):
+    """This function returns the settings of a site.
+
+    No output field needs them at the moment, they are only fetched when an
+    accessor like get_autoupgrade is called and then cached with the settings TTL."""
+    name = site["name"]
+    return caches["settings"].get_or_fetch(
+        name, lambda: endpoints.call("settings", cb.getSiteSettings, site=name)
+    )
+
+
+def get_autoupgrade(cb, site, caches, endpoints):
+    """This function returns whether the automatic firmware upgrade is enabled for a site."""
+    siteSettings = get_site_settings(cb, site, caches, endpoints)
+    return siteSettings["autoUpgrade"]["enable"]
+
+
+def _fetch_site(cb, site, cfg, classifier, caches, endpoints):
+    """This function fetches the device list and the client index of a site."""
+    name = site["name"]
+    devices = caches["devices"].get_or_fetch(
+        name, lambda: endpoints.call("devices", cb.getSiteDevices, site=name)
+    )
+    # The raw client list is cached, so a reloaded ssid_regex applies right away.
+    clients = caches["clients"].get_or_fetch(
+        name, lambda: _fetch_clients(cb, name, cfg.client_page_size, endpoints)
+    )
+    return devices, classifier.index_clients(clients)
+
+
+def _fetch_clients(cb, name, page_size, endpoints):
+    """This function fetches all active clients of a site, counting every page as a request.
+
+    getSiteClients only sends its requests while it is iterated, so the list is
+    built inside the call to measure the pages as part of the clients endpoint."""
+    pages = cb.getThreadPageRequests()
+    clients = endpoints.call(
+        "clients",
+        lambda site, pageSize: list(cb.getSiteClients(site=site, pageSize=pageSize)),
+        site=name,
+        pageSize=page_size,
+    )
+    endpoints.add_requests("clients", cb.getThreadPageRequests() - pages - 1)
+    return clients
+
+
+def _fetch_ap(cb, site, ap, endpoints):
+    """This function fetches the details of an AP."""
+    return endpoints.call("eap", cb.getSiteAP, site=site["name"], mac=ap["mac"])
+
+
+def _fingerprint(ap):
+    return tuple(ap.get(field, None) for field in _DETAIL_FINGERPRINT)
+
+
+def _details_changed(entry, ap):
+    """This function returns True if the cached details of an AP may be outdated.
+
+    That is the case if one of the fingerprint fields changed or the uptime
+    went backwards because the AP rebooted."""
+    if entry.fingerprint != _fingerprint(ap):
+        return True
+    return _to_int(ap.get("uptimeLong"), 0) < entry.uptime
+
+
+def _with_fast_fields(details, ap):
+    """This function returns the details with the fast-changing fields of the device list."""
+    fast = {field: ap[field] for field in _FAST_FIELDS if field in ap}
+    if not fast:
+        return details
+    merged = dict(details)
+    merged.update(fast)
+    return merged
+
+
+def _radio_traffic(moreAPInfos):
+    """This function returns the bytes sent and received by both radios of an AP."""
+    tx = 0
+    rx = 0
+    radioTraffic2g = moreAPInfos.get("radioTraffic2g", None)
+    if radioTraffic2g is not None:
+        tx = tx + radioTraffic2g.get("tx", 0)
+        rx = rx + radioTraffic2g.get("rx", 0)
+
+    radioTraffic5g = moreAPInfos.get("radioTraffic5g", None)
+    if radioTraffic5g is not None:
+        tx = tx + radioTraffic5g.get("tx", 0)
+        rx = rx + radioTraffic5g.get("rx", 0)
+    return tx, rx
+
+
+def _build_accesspoint(
+    site, ap, moreAPInfos, client_index, cfg, nodelist, geocoder, endpoints
+):
+    """This function builds the Accesspoint object from the fetched information."""
+    ap_mac = ap["mac"]
+    mac = normalize_mac(ap_mac)
+    (
+        client_count,
+        client_count24,
+        client_count5,
+    ) = get_client_count_for_ap(client_index=client_index, ap_mac=ap_mac)
+
+    # Traffic from entire AP (TODO: Filter Freifunk for ?SSID?)
+    # (
+    # tx2,
+    # rx2,
+    # ) = get_traffic_count_for_ap(client_index=client_index, ap_mac=ap_mac)
+
+    if "download" in ap and "upload" in ap:
+        # The totals of the device list are fresh on every crawl, unlike the
+        # radio counters of cached details, and are used with and without
+        # incremental crawls so the counters do not jump when it is toggled.
+        # What the clients download is what the AP sends.
+        tx = _to_int(ap["download"])
+        rx = _to_int(ap["upload"])
+    else:
+        tx, rx = _radio_traffic(moreAPInfos)
+
+    mem_used, mem_buffer, mem_total = _extract_memory(ap, moreAPInfos)
+
+    frequency24 = None
+    wp2g = moreAPInfos.get("wp2g", None)
+    if wp2g is not None and wp2g.get("actualChannel", None) is not None:
+        frequency24 = get_ap_frequency(wp2g.get("actualChannel"))
+
+    frequency5 = None
+    wp5g = moreAPInfos.get("wp5g", None)
+    if wp5g is not None and wp5g.get("actualChannel", None) is not None:
+        frequency5 = get_ap_frequency(wp5g.get("actualChannel"))
+
+    offloader_mac = cfg.offloader_mac.get(site["name"], None)
+    neighbour_macs = [offloader_mac]
+    offloader = nodelist.get(offloader_mac) if offloader_mac else None
+    if offloader is not None:
+        offloader_id = offloader_mac.replace(":", "")
+        gateway, gateway6 = offloader.gateway, offloader.gateway6
+        domain_code = offloader.domain
+    else:
+        offloader_id = None
+        gateway, gateway6 = None, None
+        domain_code = None
+
+    uplink = ap.get("uplink", None)
+    if uplink is not None:
+        neighbour_macs.append(normalize_mac(uplink))
+
+    # lldp_table = ap.get("lldp_table", None)
+    # if lldp_table is not None:
+    # for lldp_entry in lldp_table:
+    # if not lldp_entry.get("is_wired", True):
+    # neighbour_macs.append(lldp_entry.get("chassis_id"))
+
+    # Location
+    lat, lon = 0, 0
+    location = moreAPInfos.get("location", None)
+    if location is not None:
+        if (
+            location.get("longitude", None) is not None
+            and location.get("latitude", None) is not None
+        ):
+            lon = location["longitude"]
+            lat = location["latitude"]
+
+    snmp = moreAPInfos.get("snmp", None)
+    if snmp.get("location", None) is None:
+        return None
+
+    if snmp.get("location", None) != "":
+        with endpoints.timed(site["name"], "geocode"):
+            coordinates = get_location_by_address(snmp["location"], geocoder)
+        if coordinates is not None:
+            lat, lon = coordinates
+
+    return Accesspoint(
+        name=ap.get("name", None),
+        mac=mac,
+        node_id=mac.replace(":", ""),
+        snmp_location=snmp.get("location", None),
+        client_count=client_count,
+        client_count24=client_count24,
+        client_count5=client_count5,
+        frequency24=frequency24,
+        frequency5=frequency5,
+        latitude=float(lat),
+        longitude=float(lon),
+        model=ap.get("showModel", None),
+        firmware=ap.get("version", None),
+        uptime=moreAPInfos.get("uptimeLong", None),
+        contact=snmp.get("contact", None),
+        load_avg=_extract_loadavg(ap, moreAPInfos),
+        mem_used=mem_used,
+        mem_buffer=mem_buffer,
+        mem_total=mem_total,
+        tx_bytes=tx,
+        rx_bytes=rx,
+        gateway=gateway,
+        gateway6=gateway6,
+        gateway_nexthop=offloader_id,
+        neighbour_macs=tuple(neighbour_macs),
+        domain_code=domain_code if domain_code is not None else cfg.fallback_domain,
+        # autoupdater=get_autoupgrade(cb, site, caches, endpoints),
+    )
+
+
+def get_infos(cfg):
+    """This function gathers all the information and returns an Accesspoints snapshot.
+
+    Sites and APs are fetched concurrently by at most cfg.max_workers threads.
+    With cfg.incremental the details of an AP are only fetched again if the
+    device list shows that they may have changed or they are older than
+    the eap cache TTL. Responses of the other endpoints are cached as
+    configured in cfg.cache_ttl."""
+    crawl_start = time.monotonic()
+    endpoints = EndpointCounter()
+    with endpoints.timed("", "nodelist"):
+        nodelist = get_nodelist(cfg)
+    try:
+        with endpoints.timed("", "login"):
+            cb = get_session(cfg)
+        # Refresh the privileges so that newly added sites are picked up.
+        cb.currentUser = endpoints.call("user", cb.getCurrentUser)
+    except Exception as ex:
+        logger.error("Error: %s" % (ex))
+        return
+    geocoder = get_geocoder(cfg)
+    sites = cb.currentUser["privilege"]["sites"]
+    classifier = SsidClassifier(cfg.ssid_regex)
+    caches = get_caches(cfg)
+    page_requests_start = cb.pageRequests
+
+    with ThreadPoolExecutor(max_workers=cfg.max_workers) as executor:
+        # All sites are fetched first so that no site task waits for AP tasks
+        # queued behind it in the same bounded pool.
+        fetched_sites = executor.map(
+            lambda site: _fetch_site(cb, site, cfg, classifier, caches, endpoints),
+            sites,
         )
-        siteSettings = csite.getSiteSettings()
-        autoupgrade = siteSettings["autoUpgrade"]["enable"]
-        aps_for_site = csite.getSiteDevices()
-
-        for ap in aps_for_site:
-            if (
-                ap.get("name", None) is not None
-                and (ap.get("status", 0) != 0 and ap.get("status", 0) != 20)
-                and ap.get("type") == "ap"
-            ):
-                ap_mac = ap["mac"]
-                moreAPInfos = csite.getSiteAP(mac=ap_mac)
-                ssids = moreAPInfos.get("ssidOverrides", None)
-                containsSSID = False
-                if ssids is not None:
-                    for ssid in ssids:
-                        if re.search(
-                            cfg.ssid_regex, ssid.get("ssid", ""), re.IGNORECASE
-                        ):
-                            if (ssid.get("ssidEnabled"), False):
-                                containsSSID = True
-
-                if containsSSID is False:
-                    continue  # Skip AP if Freifunk SSID is missing
-
-                (
-                    client_count,
-                    client_count24,
-                    client_count5,
-                ) = get_client_count_for_ap(
-                    clients=csite.getSiteClientsAP(apmac=ap_mac), cfg=cfg
+        with tracing.span("sites", count=len(sites)):
+            candidates = [
+                (site, ap, client_index)
+                for site, (aps_for_site, client_index) in zip(sites, fetched_sites)
+                for ap in aps_for_site
+                if _is_online_ap(ap)
+            ]
+
+        # The eap cache keeps one entry per AP, it must fit the whole fleet or
+        # incremental crawls keep evicting and refetching details.
+        caches["eap"].maxsize = max(cfg.cache_size, len(candidates))
+
+        with tracing.span("aps", count=len(candidates)):
+            # Without incremental crawls the details of every AP are fetched.
+            details = {}
+            stale = []
+            for site, ap, _ in candidates:
+                key = (site["name"], ap["mac"])
+                entry = None
+                if cfg.incremental:
+                    entry = caches["eap"].get(
+                        key, valid=lambda entry: not _details_changed(entry, ap)
+                    )
+                if entry is None:
+                    stale.append((site, ap))
+                else:
+                    details[key] = entry
+            fetched = executor.map(
+                lambda candidate: _fetch_ap(cb, candidate[0], candidate[1], endpoints),
+                stale,
+            )
+            for (site, ap), moreAPInfos in zip(stale, fetched):
+                key = (site["name"], ap["mac"])
+                details[key] = ApDetails(
+                    details=moreAPInfos, fingerprint=_fingerprint(ap), uptime=0
                 )
+                if cfg.incremental:
+                    caches["eap"].put(key, details[key])
+
+    with tracing.span("build", count=len(candidates)):
+        accesspoints = []
+        for site, ap, client_index in candidates:
+            entry = details[(site["name"], ap["mac"])]
+            entry.uptime = _to_int(ap.get("uptimeLong"), 0)
+            moreAPInfos = entry.details
+            if cfg.incremental:
+                moreAPInfos = _with_fast_fields(moreAPInfos, ap)
+            if not _contains_ssid(moreAPInfos, classifier):
+                continue  # Skip AP if Freifunk SSID is missing
+            accesspoint = _build_accesspoint(
+                site, ap, moreAPInfos, client_index, cfg, nodelist, geocoder, endpoints
+            )
+            if accesspoint is not None:
+                accesspoints.append(accesspoint)
+    logger.debug("Fetched the details of %d of %d APs" % (len(stale), len(candidates)))
+    logger.debug(
+        "Request latency: "
+        + ", ".join(
+            "%s p50 <= %.0fms, p99 <= %.0fms"
+            % (
+                endpoint,
+                histogram.quantile(0.5) * 1000,
+                histogram.quantile(0.99) * 1000,
+            )
+            for endpoint, histogram in sorted(get_endpoint_latency().items())
+        )
+    )
+    logger.debug(
+        "Cache hit rates: "
+        + ", ".join(
+            "%s %.0f%%" % (cache.name, cache.hit_rate * 100)
+            for cache in caches.values()
+        )
+    )
 
-                # Traffic from entire AP (TODO: Filter Freifunk for ?SSID?)
-                # (
-                # tx2,
-                # rx2,
-                # ) = get_traffic_count_for_ap(clients=csite.getSiteClientsAP(apmac=ap_mac), cfg=cfg)
-
-                tx = 0
-                rx = 0
-                radioTraffic2g = moreAPInfos.get("radioTraffic2g", None)
-                if radioTraffic2g is not None:
-                    tx = tx + radioTraffic2g.get("tx", 0)
-                    rx = rx + radioTraffic2g.get("rx", 0)
-
-                radioTraffic5g = moreAPInfos.get("radioTraffic5g", None)
-                if radioTraffic5g is not None:
-                    tx = tx + radioTraffic5g.get("tx", 0)
-                    rx = rx + radioTraffic5g.get("rx", 0)
-
-                mem_used, mem_buffer, mem_total = _extract_memory(ap, moreAPInfos)
-
-                frequency24 = None
-                wp2g = moreAPInfos.get("wp2g", None)
-                if wp2g is not None and wp2g.get("actualChannel", None) is not None:
-                    frequency24 = get_ap_frequency(wp2g.get("actualChannel"))
-
-                frequency5 = None
-                wp5g = moreAPInfos.get("wp5g", None)
-                if wp5g is not None and wp5g.get("actualChannel", None) is not None:
-                    frequency5 = get_ap_frequency(wp5g.get("actualChannel"))
-
-                neighbour_macs = []
-                try:
-                    neighbour_macs.append(cfg.offloader_mac.get(site["name"], None))
-                    offloader_id = cfg.offloader_mac.get(site["name"], "").replace(
-                        ":", ""
-                    )
-                    offloader = list(
-                        filter(
-                            lambda x: x["mac"]
-                            == cfg.offloader_mac.get(site["name"], ""),
-                            ffnodes["nodes"],
-                        )
-                    )[0]
-                except:
-                    offloader_id = None
-                    offloader = {}
-                    pass
-
-                uplink = ap.get("uplink", None)
-                if uplink is not None:
-                    neighbour_macs.append(uplink.replace("-", ":"))
-
-                # lldp_table = ap.get("lldp_table", None)
-                # if lldp_table is not None:
-                # for lldp_entry in lldp_table:
-                # if not lldp_entry.get("is_wired", True):
-                # neighbour_macs.append(lldp_entry.get("chassis_id"))
-
-                # Location
-                lat, lon = 0, 0
-                location = moreAPInfos.get("location", None)
-                if location is not None:
-                    if (
-                        location.get("longitude", None) is not None
-                        and location.get("latitude", None) is not None
-                    ):
-                        lon = location["longitude"]
-                        lat = location["latitude"]
-
-                snmp = moreAPInfos.get("snmp", None)
-                if snmp.get("location", None) is not None:
-                    if snmp.get("location", None) != "":
-                        try:
-                            lat, lon = get_location_by_address(
-                                snmp["location"], geolookup
-                            )
-                        except:
-                            pass
-
-                    aps.accesspoints.append(
-                        Accesspoint(
-                            name=ap.get("name", None),
-                            mac=ap_mac.replace("-", ":").lower(),
-                            snmp_location=snmp.get("location", None),
-                            client_count=client_count,
-                            client_count24=client_count24,
-                            client_count5=client_count5,
-                            frequency24=frequency24,
-                            frequency5=frequency5,
-                            latitude=float(lat),
-                            longitude=float(lon),
-                            model=ap.get("showModel", None),
-                            firmware=ap.get("version", None),
-                            uptime=moreAPInfos.get("uptimeLong", None),
-                            contact=snmp.get("contact", None),
-                            load_avg=_extract_loadavg(ap, moreAPInfos),
-                            mem_used=mem_used,
-                            mem_buffer=mem_buffer,
-                            mem_total=mem_total,
-                            tx_bytes=tx,
-                            rx_bytes=rx,
-                            gateway=offloader.get("gateway", None),
-                            gateway6=offloader.get("gateway6", None),
-                            gateway_nexthop=offloader_id,
-                            neighbour_macs=neighbour_macs,
-                            domain_code=offloader.get("domain", cfg.fallback_domain),
-                            # autoupdater=autoupgrade,
-                        )
-                    )
-    return aps
+    crawl_stop = time.monotonic()
+    page_requests = cb.pageRequests - page_requests_start
+    logger.debug("Crawl needed %d page requests" % page_requests)
+    return Accesspoints(
+        accesspoints=tuple(accesspoints),
+        collected_at=crawl_stop,
+        refresh_duration=crawl_stop - crawl_start,
+        page_requests=page_requests,
+        endpoint_requests=endpoints.as_dict(),
+        phase_durations=endpoints.durations(),
+    )
 
 
 def main():
     """This function is the main function, it's only executed if we aren't imported."""
-    print(get_infos())
+    print(get_infos(config.get_config()))
 
 
 if __name__ == "__main__":
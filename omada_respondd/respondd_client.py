@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import asyncio
+import signal
 import socket
 import struct
 import json
@@ -7,13 +9,30 @@ import zlib
 import time
 
 import dataclasses
-from dataclasses_json import dataclass_json
-from omada_respondd import omada_client
+from omada_respondd.collector import Collector
+from omada_respondd.exporter import MetricsServer
+from omada_respondd.metrics import Counter, Histogram
+from omada_respondd.sendmmsg import BatchSender, Datagrams
 from omada_respondd import logger
-from typing import List, Dict
+from typing import Any, List, Dict
 
+# The request types respondd answers, anything else in a request is ignored.
+RESPONSE_TYPES = ("nodeinfo", "statistics", "neighbours")
 
-@dataclasses.dataclass
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """Serializes a response to JSON, using orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return bytes(json.dumps(obj), "UTF-8")
+
+
+@dataclasses.dataclass(slots=True)
 class FirmwareInfo:
     """This class contains the firmware information of an AP.
     Attributes:
@@ -24,7 +43,7 @@ class FirmwareInfo:
     release: str
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class LocationInfo:
     """This class contains the location information of an AP.
     Attributes:
@@ -35,7 +54,7 @@ class LocationInfo:
     longitude: float
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class HardwareInfo:
     """This class contains the hardware information of an AP.
     Attributes:
@@ -45,7 +64,7 @@ class HardwareInfo:
     nproc: int = 1
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class OwnerInfo:
     """This class contains the owner information of an AP.
     Attributes:
@@ -54,7 +73,7 @@ class OwnerInfo:
     contact: str
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class SoftwareInfo:
     """This class contains the software information of an AP.
     Attributes:
@@ -64,17 +83,17 @@ class SoftwareInfo:
     # autoupdater: str
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class InterfacesInfo:
     other: List[str]
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class IntInfo:
     interfaces: InterfacesInfo
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class NetworkInfo:
     """This class contains the network information of an AP.
     Attributes:
@@ -84,13 +103,12 @@ class NetworkInfo:
     mesh: Dict[str, IntInfo]
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class SystemInfo:
     domain_code: str
 
 
-@dataclass_json
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class NodeInfo:
     """This class contains the node information of an AP.
     Attributes:
@@ -111,8 +129,38 @@ class NodeInfo:
     network: NetworkInfo
     system: SystemInfo
 
-
-@dataclasses.dataclass
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the respondd representation of the node information."""
+        return {
+            "software": {
+                "firmware": {
+                    "base": self.software.firmware.base,
+                    "release": self.software.firmware.release,
+                },
+            },
+            "hostname": self.hostname,
+            "node_id": self.node_id,
+            "location": {
+                "latitude": self.location.latitude,
+                "longitude": self.location.longitude,
+            },
+            "hardware": {
+                "model": self.hardware.model,
+                "nproc": self.hardware.nproc,
+            },
+            "owner": {"contact": self.owner.contact},
+            "network": {
+                "mac": self.network.mac,
+                "mesh": {
+                    name: {"interfaces": {"other": list(mesh.interfaces.other)}}
+                    for name, mesh in self.network.mesh.items()
+                },
+            },
+            "system": {"domain_code": self.system.domain_code},
+        }
+
+
+@dataclasses.dataclass(slots=True)
 class ClientInfo:
     """This class contains the client information of an AP.
     Attributes:
@@ -127,7 +175,7 @@ class ClientInfo:
     wifi5: int
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class WirelessInfo:
     """This class contains the Wireless information of an AP.
     Attributes:
@@ -146,7 +194,7 @@ class WirelessInfo:
     # tx: int
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class MemoryInfo:
     """This class contains the memory information of an AP.
     Attributes:
@@ -159,7 +207,7 @@ class MemoryInfo:
     buffers: int
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class txInfo:
     """This class contains the tx information of an AP.
     Attributes:
@@ -168,7 +216,7 @@ class txInfo:
     bytes: int
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class rxInfo:
     """This class contains the rx information of an AP.
     Attributes:
@@ -177,7 +225,7 @@ class rxInfo:
     bytes: int
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class TrafficInfo:
     """This class contains the traffic information of an AP.
     Attributes:
@@ -188,8 +236,7 @@ class TrafficInfo:
     rx: rxInfo
 
 
-@dataclass_json
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class StatisticsInfo:
     """This class contains the statistics information of an AP.
     Attributes:
@@ -215,34 +262,106 @@ class StatisticsInfo:
     gateway_nexthop: str
     wireless: List[WirelessInfo]
 
-
-@dataclasses.dataclass
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the respondd representation of the statistics."""
+        return {
+            "clients": {
+                "total": self.clients.total,
+                "wifi": self.clients.wifi,
+                "wifi24": self.clients.wifi24,
+                "wifi5": self.clients.wifi5,
+            },
+            "uptime": self.uptime,
+            "node_id": self.node_id,
+            "loadavg": self.loadavg,
+            "memory": {
+                "total": self.memory.total,
+                "free": self.memory.free,
+                "buffers": self.memory.buffers,
+            },
+            "traffic": {
+                "tx": {"bytes": self.traffic.tx.bytes},
+                "rx": {"bytes": self.traffic.rx.bytes},
+            },
+            "gateway": self.gateway,
+            "gateway6": self.gateway6,
+            "gateway_nexthop": self.gateway_nexthop,
+            "wireless": [{"frequency": info.frequency} for info in self.wireless],
+        }
+
+
+@dataclasses.dataclass(slots=True)
 class NeighbourDetails:
     tq: int
     lastseen: float
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Neighbours:
     neighbours: Dict[str, NeighbourDetails]
 
 
-@dataclass_json
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class NeighboursInfo:
     node_id: str
     batadv: Dict[str, Neighbours]
 
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the respondd representation of the neighbours."""
+        return {
+            "node_id": self.node_id,
+            "batadv": {
+                mac: {
+                    "neighbours": {
+                        neighbour_mac: {"tq": details.tq, "lastseen": details.lastseen}
+                        for neighbour_mac, details in neighbours.neighbours.items()
+                    }
+                }
+                for mac, neighbours in self.batadv.items()
+            },
+        }
+
 
 class ResponddClient:
-    """This class receives a request from the respondd server and returns the response."""
+    """This class receives a request from the respondd server and returns the response.
+
+    It counts the requests it answered and the datagrams and bytes it sent, and
+    records how long requests took from receiving to sending as well as the
+    time spent building and sending responses."""
 
     def __init__(self, config):
         self._config = config
         self._aps = None
+        self._responses = {}
+        self._responsesGeneration = None
+        self._collector = Collector(config.poll_interval, config.trace_buffer_size)
         self._timeStart = time.time()
         self._timeStop = time.time()
+        self.requestCount = Counter()
+        self.requestLatency = Histogram()
+        self.buildLatency = Histogram()
+        self.sendLatency = Histogram()
+        self.datagramsSent = Counter()
+        self.bytesSent = Counter()
         self._sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        self._sender = BatchSender(
+            self._sock, config.send_batch_size, config.send_pacing
+        )
+
+    def currentSnapshot(self):
+        """This method returns the snapshot to answer a request from.
+
+        With max_staleness set, an older snapshot is refreshed first, concurrent
+        requests share that refresh."""
+        if self._config.max_staleness is None:
+            return self._collector.snapshot
+        return self._collector.get_snapshot(self._config.max_staleness)
+
+    def isSnapshotCurrent(self, snapshot):
+        """This method returns True if the given snapshot can be answered from without a refresh."""
+        return self._config.max_staleness is None or (
+            snapshot is not None and snapshot.age <= self._config.max_staleness
+        )
 
     @property
     def _nodeinfos(self):
@@ -279,7 +398,7 @@ class ResponddClient:
                         # autoupdater=ap.autoupdater,
                     ),
                     hostname=ap.name,
-                    node_id=ap.mac.replace(":", ""),
+                    node_id=ap.node_id,
                     location=LocationInfo(latitude=ap.latitude, longitude=ap.longitude),
                     hardware=HardwareInfo(model=ap.model),
                     owner=OwnerInfo(contact=ap.contact),
@@ -328,7 +447,7 @@ class ResponddClient:
                         wifi5=ap.client_count5,
                     ),
                     uptime=ap.uptime,
-                    node_id=ap.mac.replace(":", ""),
+                    node_id=ap.node_id,
                     loadavg=ap.load_avg,
                     memory=MemoryInfo(
                         total=int(mem_total / 1024),
@@ -358,7 +477,7 @@ class ResponddClient:
                     nbs[neighbour_mac] = NeighbourDetails(tq=255, lastseen=0.45)
             neighbours.append(
                 NeighboursInfo(
-                    node_id=ap.mac.replace(":", ""),
+                    node_id=ap.node_id,
                     batadv={ap.mac: Neighbours(neighbours=nbs)},
                 )
             )
@@ -378,8 +497,8 @@ class ResponddClient:
             logger.debug("will now sleep " + str(timeSleep) + " seconds")
         time.sleep(timeSleep)
 
-    def start(self):
-        """This method starts the respondd client."""
+    def setupSocket(self):
+        """This method binds the socket to the interface and joins the multicast group."""
         self._sock.setsockopt(
             socket.SOL_SOCKET,
             socket.SO_BINDTODEVICE,
@@ -392,8 +511,42 @@ class ResponddClient:
                 self._sock, self._config.multicast_address, self._config.interface
             )
 
+    @staticmethod
+    def parseRequest(msgSplit):
+        """This method returns the requested types and whether it is a multi request.
+
+        Unknown types are dropped and the rest is sorted, so a requester can't
+        make up arbitrarily many distinct requests to be cached."""
+        if msgSplit[0] == "GET":  # multi_request
+            requestTypes, multiRequest = msgSplit[1:], True
+        else:
+            requestTypes, multiRequest = msgSplit[:1], False  # single_request
+        unknown = [request for request in requestTypes if request not in RESPONSE_TYPES]
+        if unknown:
+            logger.warning("unknown command: " + " ".join(unknown))
+        return sorted(set(requestTypes) - set(unknown)), multiRequest
+
+    def start(self):
+        """This method starts the respondd client."""
+        self.setupSocket()
+        self._collector.start()
+        if self._config.trace_buffer_size > 0:
+            signal.signal(signal.SIGUSR1, self.dumpTrace)
+        if self._config.metrics_port is not None:
+            MetricsServer(
+                self, self._config.metrics_address, self._config.metrics_port
+            ).start()
+        if self._config.poll_interval > 0:
+            # Requests arriving meanwhile wait in the socket buffer instead of
+            # being dropped for lack of a snapshot.
+            while not self._collector.wait_for_snapshot(self._config.poll_interval):
+                logger.warning("Still waiting for the first snapshot")
+
+        if self._config.server_mode == "asyncio":
+            asyncio.run(self.serve())
+            return
+
         while True:
-            responseStruct = {}
             sourceAddress = (self._config.unicast_address, self._config.unicast_port)
             msgSplit = ["GET", "nodeinfo", "statistics", "neighbours"]
 
@@ -402,17 +555,46 @@ class ResponddClient:
             else:
                 self.sendUnicast()
             self._timeStart = time.time()
-            self._aps = omada_client.get_infos()
+            self._aps = self.currentSnapshot()
             if self._aps is None:
                 continue
-            if msgSplit[0] == "GET":  # multi_request
-                for request in msgSplit[1:]:
-                    responseStruct[request] = self.buildStruct(request)
-                self.sendStruct(sourceAddress, responseStruct, True)
-            else:  # single_request
-                responseStruct = self.buildStruct(msgSplit[0])
-                self.sendStruct(sourceAddress, responseStruct, False)
+            self.sendStruct(
+                sourceAddress, self.getResponses(*self.parseRequest(msgSplit))
+            )
             self._timeStop = time.time()
+            self.requestCount.inc()
+            self.requestLatency.observe(self._timeStop - self._timeStart)
+
+    def dumpTrace(self, signum=None, frame=None):
+        """This method dumps the trace of the slowest recent crawl, it handles SIGUSR1."""
+        try:
+            self._collector.traces.dump(self._config.trace_file)
+        except Exception as ex:
+            logger.error("Error: %s" % (ex))
+
+    async def serve(self):
+        """This method answers requests on an asyncio event loop until cancelled."""
+        loop = asyncio.get_running_loop()
+        self._sock.setblocking(False)
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: ResponddProtocol(self), sock=self._sock
+        )
+        try:
+            while True:
+                if self._config.multicast_enabled:
+                    await asyncio.sleep(60)
+                else:
+                    timeSleep = int(60 - (self._timeStop - self._timeStart) % 60)
+                    await asyncio.sleep(timeSleep)
+                    self._timeStart = time.time()
+                    protocol.enqueue(
+                        ["GET", "nodeinfo", "statistics", "neighbours"],
+                        (self._config.unicast_address, self._config.unicast_port),
+                    )
+                    self._timeStop = time.time()
+                protocol.logLatency()
+        finally:
+            transport.close()
 
     def merge_node(self, responseStruct):
         """This method merges the node information of all APs to their corresponding node_id."""
@@ -442,25 +624,167 @@ class ResponddClient:
 
         return responseClass
 
-    def sendStruct(self, destAddress, responseStruct, withCompression):
-        """This method sends the response structure to the respondd server."""
-        logger.debug(
-            str(destAddress[0]) + " " + str(destAddress[1]) + " " + str(responseStruct)
-        )
-        merged = self.merge_node(responseStruct)
-
-        for infos in merged.values():
+    def getResponses(self, requestTypes, multiRequest):
+        """This method returns the datagrams answering a request.
+
+        They are built once per snapshot and request, repeated requests only cost a lookup.
+        """
+        if not requestTypes:
+            return Datagrams(())
+        if self._responsesGeneration != self._aps.generation:
+            self._responses = {}
+            self._responsesGeneration = self._aps.generation
+        key = (tuple(requestTypes), multiRequest)
+        responses = self._responses.get(key)
+        if responses is None:
+            start = time.perf_counter()
+            responses = self.buildResponses(requestTypes, multiRequest)
+            self.buildLatency.observe(time.perf_counter() - start)
+            self._responses[key] = responses
+        return responses
+
+    def buildResponses(self, requestTypes, multiRequest):
+        """This method serializes the response of every node, compressed for multi requests."""
+        if multiRequest:
+            responseStruct = {}
+            for request in requestTypes:
+                responseStruct[request] = self.buildStruct(request)
+            nodes = []
+            for infos in self.merge_node(responseStruct).values():
+                node = {}
+                for key, info in infos.items():
+                    node.update({key: info.to_dict()})
+                nodes.append(node)
+        else:
+            nodes = [info.to_dict() for info in self.buildStruct(requestTypes[0]) or []]
 
-            node = {}
-            for key, info in infos.items():
-                node.update({key: info.to_dict()})
-            responseData = bytes(json.dumps(node), "UTF-8")
-            logger.info(str(responseData))
+        responses = []
+        for node in nodes:
+            responseData = dumps(node)
+            logger.debug("%s", responseData)
 
-            if withCompression:
+            if multiRequest:
                 encoder = zlib.compressobj(
                     zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15
                 )
                 responseData = encoder.compress(responseData)
                 responseData += encoder.flush()
-            self._sock.sendto(responseData, destAddress)
+            responses.append(responseData)
+        return Datagrams(responses)
+
+    def sendStruct(self, destAddress, responses):
+        """This method sends the prepared responses to the respondd server."""
+        logger.debug(
+            str(destAddress[0])
+            + " "
+            + str(destAddress[1])
+            + " "
+            + str(len(responses))
+            + " responses"
+        )
+        start = time.perf_counter()
+        self._sender.sendall(responses, destAddress)
+        self.recordSent(responses, time.perf_counter() - start)
+
+    def recordSent(self, responses, duration):
+        """This method counts the responses sent to one requester."""
+        self.sendLatency.observe(duration)
+        self.datagramsSent.inc(len(responses))
+        self.bytesSent.inc(responses.size)
+
+
+class ResponddProtocol(asyncio.DatagramProtocol):
+    """This class answers respondd requests on an asyncio event loop.
+
+    Requests received in the same loop iteration are coalesced: every distinct
+    request is looked up once and its datagrams are sent to all requesters."""
+
+    def __init__(self, client):
+        self._client = client
+        self._transport = None
+        self._pending = {}
+        self.latency = client.requestLatency
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        logger.debug("Using multicast method")
+        self.enqueue(str(data, "UTF-8").split(" "), addr)
+
+    def error_received(self, exc):
+        logger.error("Error: %s" % (exc))
+
+    def enqueue(self, msgSplit, addr):
+        """This method queues a request to be answered in the next loop iteration."""
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self.flush)
+        requestTypes, multiRequest = self._client.parseRequest(msgSplit)
+        key = (tuple(requestTypes), multiRequest)
+        self._pending.setdefault(key, []).append((addr, time.perf_counter()))
+
+    def flush(self):
+        """This method answers all queued requests from the current snapshot.
+
+        If the snapshot has to be refreshed first, the crawl runs in a worker
+        thread and the requests are answered once it finished."""
+        pending, self._pending = self._pending, {}
+        # The snapshot is read once, so it cannot go stale between the check
+        # and the answer and start a crawl on the event loop.
+        snapshot = self._client._collector.snapshot
+        if self._client.isSnapshotCurrent(snapshot):
+            self.answer(pending, snapshot)
+            return
+        future = asyncio.get_running_loop().run_in_executor(
+            None, self._client.currentSnapshot
+        )
+        future.add_done_callback(lambda done: self.answer(pending, done.result()))
+
+    def answer(self, pending, snapshot):
+        """This method sends the responses for the given requests."""
+        self._client._aps = snapshot
+        if snapshot is None:
+            return
+        for (requestTypes, multiRequest), requesters in pending.items():
+            responses = self._client.getResponses(requestTypes, multiRequest)
+            for addr, received in requesters:
+                start = time.perf_counter()
+                self.send(responses, addr)
+                self._client.recordSent(responses, time.perf_counter() - start)
+                self._client.requestCount.inc()
+                self.latency.observe(time.perf_counter() - received)
+
+    def send(self, responses, addr, start=0):
+        """This method sends the responses batch by batch, pausing between batches if configured.
+
+        Batches go straight to the socket while the transport has nothing buffered,
+        what the socket doesn't take is handed to the transport to send when writable.
+        """
+        sender = self._client._sender
+        while start < len(responses):
+            end = min(start + sender.batch_size, len(responses))
+            sent = 0
+            if self._transport.get_write_buffer_size() == 0:
+                sent = sender.send(responses, addr, start)
+            for responseData in responses[start + sent : end]:
+                self._transport.sendto(responseData, addr)
+            start = end
+            if sender.pacing > 0 and start < len(responses):
+                asyncio.get_running_loop().call_later(
+                    sender.pacing, self.send, responses, addr, start
+                )
+                return
+
+    def logLatency(self):
+        """This method logs the response latency observed so far."""
+        if self.latency.count == 0:
+            return
+        logger.info(
+            "Answered %d requests, mean %.2fms, p50 <= %.2fms, p99 <= %.2fms"
+            % (
+                self.latency.count,
+                self.latency.sum / self.latency.count * 1000,
+                self.latency.quantile(0.5) * 1000,
+                self.latency.quantile(0.99) * 1000,
+            )
+        )
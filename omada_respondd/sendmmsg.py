@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+import time
+
+from omada_respondd import logger
+from typing import Optional, Sequence, Tuple
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.c_void_p),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        func = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    func.restype = ctypes.c_int
+    return func
+
+
+_sendmmsg = _load_sendmmsg()
+
+# The kernel handles at most UIO_MAXIOV messages per sendmmsg call.
+MAX_BATCH_SIZE = 1024
+
+# The size of a sockaddr_in6, shorter addresses are zero padded to it which
+# the kernel accepts for AF_INET as well.
+_SOCKADDR_SIZE = 28
+
+
+def _sockaddr(family: int, address: Tuple) -> Optional[bytes]:
+    """Returns the sockaddr structure for a numeric address or None."""
+    try:
+        if family == socket.AF_INET6:
+            host, port, flowinfo, scope_id = (tuple(address) + (0, 0))[:4]
+            host, _, interface = host.partition("%")
+            if interface and not scope_id:
+                scope_id = socket.if_nametoindex(interface)
+            return (
+                struct.pack("=H", socket.AF_INET6)
+                + struct.pack("!HI", port, flowinfo)
+                + socket.inet_pton(socket.AF_INET6, host)
+                + struct.pack("=I", scope_id)
+            )
+        if family == socket.AF_INET:
+            host, port = address[:2]
+            return (
+                struct.pack("=H", socket.AF_INET)
+                + struct.pack("!H", port)
+                + socket.inet_pton(socket.AF_INET, host)
+                + bytes(_SOCKADDR_SIZE - 8)
+            )
+    except (OSError, ValueError, TypeError):
+        pass
+    return None
+
+
+class Datagrams:
+    """This class holds prepared datagrams that can be sent with sendmmsg.
+
+    The message headers are built once, sending them to another address only
+    rewrites the shared destination address. The datagrams are kept referenced
+    so the buffers the headers point to stay valid."""
+
+    def __init__(self, datagrams: Sequence[bytes]):
+        self.datagrams = tuple(datagrams)
+        self.size = sum(len(data) for data in self.datagrams)
+        self._name = None
+        self._messages = None
+        if _sendmmsg is None or not self.datagrams:
+            return
+        count = len(self.datagrams)
+        self._name = ctypes.create_string_buffer(_SOCKADDR_SIZE)
+        self._iovecs = (_iovec * count)()
+        self._messages = (_mmsghdr * count)()
+        base = ctypes.addressof(self._iovecs)
+        for i, data in enumerate(self.datagrams):
+            self._iovecs[i].iov_base = ctypes.cast(data, ctypes.c_void_p).value
+            self._iovecs[i].iov_len = len(data)
+            header = self._messages[i].msg_hdr
+            header.msg_name = ctypes.addressof(self._name)
+            header.msg_namelen = _SOCKADDR_SIZE
+            header.msg_iov = base + i * ctypes.sizeof(_iovec)
+            header.msg_iovlen = 1
+
+    def __len__(self):
+        return len(self.datagrams)
+
+    def __iter__(self):
+        return iter(self.datagrams)
+
+    def __getitem__(self, index):
+        return self.datagrams[index]
+
+    def sendmmsg(self, sock: socket.socket, sockaddr: bytes, start: int, count: int):
+        """Sends datagrams[start:start + count] with one syscall, returns the number sent."""
+        ctypes.memmove(self._name, sockaddr, len(sockaddr))
+        sent = _sendmmsg(
+            sock.fileno(),
+            ctypes.addressof(self._messages) + start * ctypes.sizeof(_mmsghdr),
+            count,
+            0,
+        )
+        if sent < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            raise OSError(error, os.strerror(error))
+        return sent
+
+
+class BatchSender:
+    """This class sends many datagrams to one address with as few syscalls as possible.
+
+    On Linux up to `batch_size` datagrams are handed to the kernel with one
+    sendmmsg call, elsewhere (or for addresses sendmmsg can't take) they are
+    sent with one sendto per datagram. `pacing` is the pause in seconds between
+    two batches, so a burst doesn't overflow the receive buffer of the requester."""
+
+    def __init__(self, sock: socket.socket, batch_size: int = 64, pacing: float = 0):
+        self._sock = sock
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.pacing = pacing
+        if _sendmmsg is None:
+            logger.debug("sendmmsg is not available, sending datagrams one by one")
+
+    def send(self, datagrams: Datagrams, address: Tuple, start: int = 0) -> int:
+        """This method sends the batch starting at `start` and returns how many were sent.
+
+        On a non-blocking socket fewer datagrams than a batch may be sent, the
+        caller is responsible for the rest."""
+        count = min(self.batch_size, len(datagrams) - start)
+        if count <= 0:
+            return 0
+        sockaddr = None
+        if datagrams._messages is not None:
+            sockaddr = _sockaddr(self._sock.family, address)
+        if sockaddr is None:
+            return self._send_each(datagrams[start : start + count], address)
+        return datagrams.sendmmsg(self._sock, sockaddr, start, count)
+
+    def sendall(self, datagrams: Datagrams, address: Tuple):
+        """This method sends all datagrams on a blocking socket, pausing between batches."""
+        start = 0
+        while start < len(datagrams):
+            if start > 0 and self.pacing > 0:
+                time.sleep(self.pacing)
+            start += self.send(datagrams, address, start)
+
+    def _send_each(self, datagrams: Sequence[bytes], address: Tuple) -> int:
+        sent = 0
+        for data in datagrams:
+            try:
+                self._sock.sendto(data, address)
+            except BlockingIOError:
+                break
+            sent += 1
+        return sent
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import collections
+import contextlib
+import dataclasses
+import json
+import threading
+import time
+
+from omada_respondd import logger
+from typing import Any, Dict, List, Optional, Tuple
+
+# The trace of the crawl in progress, crawls never overlap (see Collector.refresh).
+_current = None
+
+
+@dataclasses.dataclass(slots=True)
+class Span:
+    """This class contains one timed stage of a crawl.
+    Attributes:
+        name: What was timed, e.g. "eap" or "GET /sites/{key}/devices".
+        start: Seconds since the start of the trace.
+        duration: Seconds the stage took.
+        thread: The name of the thread the stage ran in.
+        attributes: Additional details like the site or the page of a request,
+            kept as (name, value) pairs since a crawl records thousands of spans."""
+
+    name: str
+    start: float
+    duration: float
+    thread: str
+    attributes: Tuple[Tuple[str, Any], ...]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "thread": self.thread,
+            "attributes": dict(self.attributes),
+        }
+
+
+class Trace:
+    """This class collects the spans of one crawl, spans may be added from any thread."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.spans: List[Span] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, duration: float, **attributes):
+        """Adds a span, start is a time.perf_counter() timestamp."""
+        span = Span(
+            name=name,
+            start=start - self._origin,
+            duration=duration,
+            thread=threading.current_thread().name,
+            attributes=tuple(attributes.items()),
+        )
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._origin
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        """Returns count and total duration of the spans per name, slowest first."""
+        totals: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            total = totals.setdefault(span.name, {"count": 0, "seconds": 0.0})
+            total["count"] += 1
+            total["seconds"] += span.duration
+        return dict(
+            sorted(totals.items(), key=lambda item: item[1]["seconds"], reverse=True)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "breakdown": self.breakdown(),
+            "spans": [span.to_dict() for span in spans],
+        }
+
+
+class TraceBuffer:
+    """This class keeps the traces of the last `size` crawls."""
+
+    def __init__(self, size: int):
+        self._traces: "collections.deque[Trace]" = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def slowest(self) -> Optional[Trace]:
+        """Returns the trace of the slowest crawl in the buffer."""
+        with self._lock:
+            return max(self._traces, key=lambda trace: trace.duration, default=None)
+
+    def dump(self, path: Optional[str] = None):
+        """This method writes the slowest trace to a JSON file, or to the log without a path."""
+        trace = self.slowest()
+        if trace is None:
+            logger.info("No crawl has been traced yet")
+            return
+        if path is not None:
+            with open(path, "w") as stream:
+                json.dump(trace.to_dict(), stream, indent=2)
+            logger.info(
+                "Wrote trace of the slowest crawl (%.2fs) to %s"
+                % (trace.duration, path)
+            )
+            return
+        logger.info(
+            "Slowest of the last %d crawls took %.2fs, started at %s:"
+            % (
+                len(self._traces),
+                trace.duration,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(trace.started_at)),
+            )
+        )
+        for name, total in trace.breakdown().items():
+            logger.info(
+                "  %-40s %5d x %8.3fs" % (name, total["count"], total["seconds"])
+            )
+
+
+def start_trace(name: str) -> Trace:
+    """Starts the trace that span() and record() add to."""
+    global _current
+    _current = Trace(name)
+    return _current
+
+
+def finish_trace() -> Optional[Trace]:
+    """Finishes and returns the current trace."""
+    global _current
+    trace, _current = _current, None
+    if trace is not None:
+        trace.finish()
+    return trace
+
+
+def record(name: str, start: float, duration: float, **attributes):
+    """Adds a span to the current trace, if a crawl is traced."""
+    trace = _current
+    if trace is not None:
+        trace.record(name, start, duration, **attributes)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Times the with block as a span of the current trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, start, time.perf_counter() - start, **attributes)
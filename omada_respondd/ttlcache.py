@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import collections
+import threading
+import time
+
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """This class caches values for `ttl` seconds, evicting the least recently used.
+
+    At most `maxsize` values are kept. A ttl of 0 disables the cache, every
+    lookup is a miss and nothing is stored. Hits, misses and evictions are
+    counted so the effect of a TTL can be judged."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 4096):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "collections.OrderedDict[Hashable, tuple]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(
+        self, key: Hashable, valid: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[Any]:
+        """Returns the cached value or None if it is missing, expired or not `valid`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if time.monotonic() - stored_at > self.ttl:
+                    del self._entries[key]
+                elif valid is None or valid(value):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        """Stores a value, evicting the least recently used one if the cache is full."""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        """Returns the cached value, fetching and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.put(key, value)
+        return value
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
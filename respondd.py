@@ -1,11 +1,45 @@
 #!/usr/bin/env python3
 
+import argparse
+import dataclasses
+
 import omada_respondd.config as config
+from omada_respondd.collector import Collector
 from omada_respondd.respondd_client import ResponddClient as ResponddClient
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="respondd for Omada controllers")
+    parser.add_argument(
+        "--trace-crawls",
+        type=int,
+        metavar="N",
+        help="crawl the controller N times, dump the trace of the slowest crawl and exit",
+    )
+    parser.add_argument(
+        "--trace-file",
+        metavar="PATH",
+        help="write dumped traces to this JSON file instead of the log",
+    )
+    return parser.parse_args()
+
+
+def trace_crawls(cfg, count):
+    """This function crawls count times and dumps the trace of the slowest crawl."""
+    collector = Collector(0, count)
+    for _ in range(count):
+        collector.refresh()
+    collector.traces.dump(cfg.trace_file)
+
+
 def main():
-    cfg = config.Config.from_dict(config.load_config())
+    args = parse_args()
+    cfg = config.get_config()
+    if args.trace_file is not None:
+        cfg = dataclasses.replace(cfg, trace_file=args.trace_file)
+    if args.trace_crawls is not None:
+        trace_crawls(cfg, args.trace_crawls)
+        return
     extResponddClient = ResponddClient(cfg)
     extResponddClient.start()
 
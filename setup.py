@@ -19,9 +19,13 @@ setup(
     long_description=read("README.md"),
     long_description_content_type="text/markdown",
     include_package_data=True,
+    python_requires=">=3.10",
     install_requires=[
         "geopy==2.4.1",
         "pyyaml==6.0.3",
-        "dataclasses_json==0.6.7",
     ],
+    extras_require={
+        "streaming": ["ijson"],
+        "fast": ["orjson"],
+    },
 )